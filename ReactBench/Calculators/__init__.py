@@ -3,71 +3,46 @@ ReactBench Calculators Package
 Provides MLFF calculators for both run_pygsm.py and pysisyphus interfaces
 """
 
-# Import LeftNet calculator classes
-from .leftnet import (
-    LeftNetMLFF, get_leftnet_calculator
-)
+from functools import partial
+from importlib import import_module
 
-from .mace import (
-    MACEMLFF, get_mace_calculator
-)
-
-# Factory functions for calculators
-# LeftNet
-def create_leftnet_calculator(device="cpu"):
-    """Create LeftNet calculator for run_pygsm.py"""
-    return get_leftnet_calculator(device=device, use_autograd=True)
-
-def create_leftnet_mlff(device="cpu"):
-    """Create LeftNet MLFF for pysisyphus"""
-    return LeftNetMLFF(device=device, use_autograd=True)
-
-
-# LeftNet with direct forces
-def create_leftnet_calculator_d(device="cpu"):
-    """Create LeftNet calculator for run_pygsm.py with direct forces"""
-    return get_leftnet_calculator(device=device, use_autograd=False)
-
-def create_leftnet_mlff_d(device="cpu"):
-    """Create LeftNet MLFF for pysisyphus with direct forces"""
-    return LeftNetMLFF(device=device, use_autograd=False)
-
-# MACE-pretrained
-def create_mace_pretrained_calculator(device="cpu"):
-    """Create MACE calculator for run_pygsm.py"""
-    return get_mace_calculator(device=device, ver='pretrain')
-
-def create_mace_pretrained_mlff(device="cpu"):
-    """Create MACE MLFF for pysisyphus"""
-    return MACEMLFF(device=device, ver='pretrain')
+# Backends are imported on first use so that e.g. MACE users never load LeftNet
+_LAZY_ATTRS = {
+    'LeftNetMLFF': 'leftnet', 'get_leftnet_calculator': 'leftnet',
+    'MACEMLFF': 'mace', 'get_mace_calculator': 'mace',
+}
 
-# MACE-finetuned
-def create_mace_finetuned_calculator(device="cpu"):
-    """Create MACE calculator for run_pygsm.py"""
-    return get_mace_calculator(device=device, ver='finetuned')
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        return getattr(import_module(f'.{_LAZY_ATTRS[name]}', __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def create_mace_finetuned_mlff(device="cpu"):
-    """Create MACE MLFF for pysisyphus"""
-    return MACEMLFF(device=device, ver='finetuned')
+def _lazy(module, factory, device="cpu", **kwargs):
+    """Import a backend and call one of its factories"""
+    return getattr(import_module(f'.{module}', __name__), factory)(device=device, **kwargs)
 
 
 # Unified mapping: calculator name -> factory functions
 CALCULATOR_FACTORIES = {
+    # LeftNet
     'leftnet': {
-        'calculator': create_leftnet_calculator,
-        'mlff': create_leftnet_mlff,
+        'calculator': partial(_lazy, 'leftnet', 'get_leftnet_calculator', use_autograd=True),
+        'mlff': partial(_lazy, 'leftnet', 'LeftNetMLFF', use_autograd=True),
     },
+    # LeftNet with direct forces
     'leftnet-d': {
-        'calculator': create_leftnet_calculator_d,
-        'mlff': create_leftnet_mlff_d,
+        'calculator': partial(_lazy, 'leftnet', 'get_leftnet_calculator', use_autograd=False),
+        'mlff': partial(_lazy, 'leftnet', 'LeftNetMLFF', use_autograd=False),
     },
+    # MACE-pretrained
     'mace-pretrain': {
-        'calculator': create_mace_pretrained_calculator,
-        'mlff': create_mace_pretrained_mlff,
+        'calculator': partial(_lazy, 'mace', 'get_mace_calculator', ver='pretrain'),
+        'mlff': partial(_lazy, 'mace', 'MACEMLFF', ver='pretrain'),
     },
+    # MACE-finetuned
     'mace-finetuned': {
-        'calculator': create_mace_finetuned_calculator,
-        'mlff': create_mace_finetuned_mlff,
+        'calculator': partial(_lazy, 'mace', 'get_mace_calculator', ver='finetuned'),
+        'mlff': partial(_lazy, 'mace', 'MACEMLFF', ver='finetuned'),
     },
 }
 
@@ -1,9 +1,9 @@
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
 from torch import nn, Tensor
-from torch_scatter import scatter_mean
+from torch_scatter import segment_coo
 
 from oa_reactdiff.model import EGNN
 from oa_reactdiff.utils._graph_tools import get_subgraph_mask
@@ -28,6 +28,11 @@ class EGNNDynamics(BaseDynamics):
         enforce_same_encoding: Optional[List] = None,
         source: Optional[Dict] = None,
         fixed_idx: Optional[List] = None,
+        check_nan: bool = True,
+        pbc_graph_resolution: Optional[float] = None,
+        compile_model: bool = False,
+        autocast_dtype: Optional[torch.dtype] = None,
+        pbc_cell_length: float = 20.0,
     ) -> None:
         r"""Base dynamics class set up for denoising process.
 
@@ -45,6 +50,22 @@ class EGNNDynamics(BaseDynamics):
             edge_cutoff (Optional[float]): cutoff for building intra-fragment edges.
                 Defaults to None.
             model (Optional[nn.Module]): Module for equivariant model. Defaults to None.
+            check_nan (bool): whether to reset NaN outputs of the equivariant model
+                to randn. Disabling it removes a device sync per step.
+                Defaults to True.
+            pbc_graph_resolution (Optional[float]): grid spacing used to decide
+                whether the periodic radius graph of the previous call can be
+                reused. Defaults to None to rebuild it on every call.
+            compile_model (bool): whether to run the equivariant model through
+                torch.compile in reduce-overhead mode (CUDA graphs on GPU). Pays
+                off when the graph size stays fixed across denoising steps.
+                Defaults to False.
+            autocast_dtype (Optional[torch.dtype]): low-precision dtype (e.g.
+                torch.bfloat16) to autocast the equivariant model to. Outputs are
+                cast back so the coordinate update stays in full precision.
+                Defaults to None to run in full precision.
+            pbc_cell_length (float): edge length of the cubic cell used in pbc
+                mode. Defaults to 20.0.
         """
         super().__init__(
             model_config,
@@ -62,10 +83,22 @@ class EGNNDynamics(BaseDynamics):
             source=source,
         )
         self.fixed_idx = fixed_idx or []
+        self.check_nan = check_nan
+        self.pbc_graph_resolution = pbc_graph_resolution
+        self._frag_index_cache = None
+        self._pbc_graph_cache = None
+        self.compile_model = compile_model
+        self._compiled_model = None
+        self.autocast_dtype = autocast_dtype
+        self.register_buffer(
+            "_pbc_cell",
+            torch.eye(3, dtype=torch.float64) * pbc_cell_length,
+            persistent=False,
+        )
 
     def forward(
         self,
-        xh: List[Tensor],
+        xh: Union[List[Tensor], Tensor],
         edge_index: Tensor,
         t: Tensor,
         conditions: Tensor,
@@ -74,11 +107,14 @@ class EGNNDynamics(BaseDynamics):
         edge_attr: Optional[Tensor] = None,
         natoms: Optional[Tensor] = None,
         pbc: bool = False,
-    ) -> Tuple[List[Tensor], Tensor]:
+    ) -> Tuple[Union[List[Tensor], Tensor], Tensor]:
         r"""predict noise /mu.
 
         Args:
-            xh (List[Tensor]): list of concatenated tensors for pos and h
+            xh (Union[List[Tensor], Tensor]): list of concatenated tensors for pos
+                and h, or a single [n_nodes, pos_dim + h_dim] tensor holding all
+                fragments in n_frag_switch order. A list is packed into the
+                single-tensor layout with one concat.
             edge_index (Tensor): [n_edge, 2]
             t (Tensor): time tensor. If dim is 1, same for all samples;
                 otherwise different t for different samples
@@ -92,19 +128,29 @@ class EGNNDynamics(BaseDynamics):
             NotImplementedError: The fragement-position-fixed mode is not implement.
 
         Returns:
-            Tuple[List[Tensor], Tensor]: updated pos-h and edge attributes
+            Tuple[Union[List[Tensor], Tensor], Tensor]: updated pos-h, in the
+                same layout as xh, and edge attributes
         """
-        pos = torch.concat(
-            [_xh[:, : self.pos_dim].clone() for _xh in xh],
-            dim=0,
-        )
-        h = torch.concat(
-            [
-                self.encoders[ii](xh[ii][:, self.pos_dim :].clone())
-                for ii, name in enumerate(self.fragment_names)
-            ],
-            dim=0,
-        )
+        frag_index = self.get_frag_index(n_frag_switch)
+        # All fragments are handled in one packed [n_nodes, pos_dim + h_dim]
+        # layout: a list input is packed with a single concat, and pos and the
+        # encoder inputs are views into it.
+        packed = isinstance(xh, Tensor)
+        if not packed:
+            xh = torch.cat(xh, dim=0)
+        pos = xh[:, : self.pos_dim]
+        if self.is_shared(self.encoders):
+            h = self.encoders[0](xh[:, self.pos_dim :])
+        else:
+            h = torch.concat(
+                [
+                    self.encoders[ii](
+                        xh[frag_index[ii] : frag_index[ii + 1], self.pos_dim :]
+                    )
+                    for ii in range(len(self.encoders))
+                ],
+                dim=0,
+            )
         if self.edge_encoder is not None:
             edge_attr = self.edge_encoder(edge_attr)
 
@@ -112,7 +158,7 @@ class EGNNDynamics(BaseDynamics):
         if self.condition_time:
             if len(t.size()) == 1:
                 # t is the same for all elements in batch.
-                h_time = torch.empty_like(h[:, 0:1]).fill_(t.item())
+                h_time = t.to(h.dtype).reshape(1, 1).expand(h.size(0), 1)
             else:
                 # t is different over the batch dimension.
                 h_time = t[combined_mask]
@@ -132,19 +178,9 @@ class EGNNDynamics(BaseDynamics):
         
         distance_vectors = None
         if pbc:
-            length_of_cell = 20
-            single_cell = torch.tensor(np.eye(3) * length_of_cell).reshape(1, 3, 3)
-            cell = torch.vstack([
-                single_cell for _ in range(natoms.size(0))
-            ])
-            
-            pbc_edge_index, cell_offsets, neighbors = radius_graph_pbc(
-                pos=pos,
-                cell=cell,
-                natoms=natoms,
-                radius=self.model.cutoff,
-                max_num_neighbors_threshold=50,
-            )
+            cell = self._pbc_cell.to(torch.float64).expand(natoms.size(0), 3, 3)
+
+            pbc_edge_index, cell_offsets, neighbors = self.get_pbc_graph(pos, cell, natoms)
             pbc_edge_index, pbc_distances, pbc_distance_vectors, offsets = get_pbc_distances(
                 pos,
                 pbc_edge_index,
@@ -168,32 +204,56 @@ class EGNNDynamics(BaseDynamics):
             edge_index = torch.cat([edge_index, pbc_edge_index], axis=1)
             subgraph_mask = torch.cat([subgraph_mask, pbc_subgraph_mask])
             
-            pos = self.pbc_pos(pos, [length_of_cell] * 3)
+            pos = self.pbc_pos(pos, self._pbc_cell.diagonal())
             
 
-        h_final, pos_final, edge_attr_final = self.model(
-            h,
-            pos,
-            edge_index,
-            edge_attr,
-            node_mask=None,
-            edge_mask=None,
-            update_coords_mask=update_coords_mask,
-            subgraph_mask=subgraph_mask[:, None],
-            pbc=pbc,
-            distance_vectors=distance_vectors,
-        )
+        with torch.autocast(
+            device_type=pos.device.type,
+            dtype=self.autocast_dtype,
+            enabled=self.autocast_dtype is not None,
+        ):
+            h_final, pos_final, edge_attr_final = self.get_model_forward()(
+                h,
+                pos,
+                edge_index,
+                edge_attr,
+                node_mask=None,
+                edge_mask=None,
+                update_coords_mask=update_coords_mask,
+                subgraph_mask=subgraph_mask[:, None],
+                pbc=pbc,
+                distance_vectors=distance_vectors,
+            )
+        if self.autocast_dtype is not None:
+            h_final, pos_final = h_final.to(h.dtype), pos_final.to(pos.dtype)
+            if edge_attr_final is not None:
+                edge_attr_final = edge_attr_final.to(h.dtype)
         vel = pos_final - pos
-        if torch.any(torch.isnan(vel)):
-            print("Warning: detected nan in pos, resetting EGNN output to randn.")
-            vel = torch.randn_like(vel)
-        if torch.any(torch.isnan(vel)):
-            print("Warning: detected nan in h, resetting EGNN output to randn.")
-            h_final = torch.randn_like(h_final)
-
-        h_final = h_final[:, :-condition_dim]
-
-        frag_index = self.compute_frag_index(n_frag_switch)
+        if self.check_nan:
+            nan_pos, nan_h = torch.isnan(vel).any(), torch.isnan(h_final).any()
+            if (nan_pos | nan_h).item():
+                if nan_pos:
+                    print("Warning: detected nan in pos, resetting EGNN output to randn.")
+                    vel = torch.randn_like(vel)
+                if nan_h:
+                    print("Warning: detected nan in h, resetting EGNN output to randn.")
+                    h_final = torch.randn_like(h_final)
+
+        if condition_dim > 0:
+            # h[:, :-0] would drop every channel
+            h_final = h_final[:, :-condition_dim]
+
+        if self.is_shared(self.decoders):
+            h_decoded = self.decoders[0](h_final)
+            h_decoded = [
+                h_decoded[frag_index[ii] : frag_index[ii + 1]]
+                for ii in range(len(self.decoders))
+            ]
+        else:
+            h_decoded = [
+                self.decoders[ii](h_final[frag_index[ii] : frag_index[ii + 1]])
+                for ii in range(len(self.decoders))
+            ]
         xh_final = [
             torch.cat(
                 [
@@ -201,11 +261,11 @@ class EGNNDynamics(BaseDynamics):
                         vel[frag_index[ii] : frag_index[ii + 1]],
                         combined_mask[frag_index[ii] : frag_index[ii + 1]],
                     ),
-                    self.decoders[ii](h_final[frag_index[ii] : frag_index[ii + 1]]),
+                    h_decoded[ii],
                 ],
                 dim=-1,
             )
-            for ii, name in enumerate(self.fragment_names)
+            for ii in range(len(self.decoders))
         ]
 
         for ii in self.fixed_idx:
@@ -215,6 +275,8 @@ class EGNNDynamics(BaseDynamics):
             )
         
         # xh_final = self.enpose_pbc(xh_final)
+        if packed:
+            xh_final = torch.cat(xh_final, dim=0)
 
         if edge_attr_final is None or edge_attr_final.size(1) <= max(1, self.dist_dim):
             edge_attr_final = None
@@ -222,32 +284,85 @@ class EGNNDynamics(BaseDynamics):
             edge_attr_final = self.edge_decoder(edge_attr_final)
         return xh_final, edge_attr_final
 
+    @staticmethod
+    def is_shared(modules: nn.ModuleList) -> bool:
+        r"""Whether all fragments use the same module (see enforce_same_encoding),
+        so it can run once over the concatenated fragments."""
+        return all(module is modules[0] for module in modules)
+
+    def get_model_forward(self):
+        r"""The equivariant model call, compiled on first use when compile_model
+        is set. The compiled function is not a submodule, so checkpoints keep
+        their keys."""
+        if not self.compile_model:
+            return self.model
+        if self._compiled_model is None:
+            self._compiled_model = torch.compile(
+                self.model.forward, mode="reduce-overhead", dynamic=False
+            )
+        return self._compiled_model
+
     @staticmethod
     def enpose_pbc(xh: List[Tensor], magnitude=10.0) -> List[Tensor]:
-        xrange = magnitude * 2
-        xh = [
-            torch.remainder(_xh + magnitude, xrange) - magnitude
-            for _xh in xh
-        ]
-        return xh
+        sizes = [_xh.size(0) for _xh in xh]
+        xh_cat = torch.remainder(torch.cat(xh, dim=0) + magnitude, 2 * magnitude) - magnitude
+        return list(xh_cat.split(sizes, dim=0))
     
     @staticmethod
-    def pbc_pos(pos: List[Tensor], cell=[10, 10, 10]) -> List[Tensor]:  # TODO: generalize to non-cubic
-        for ii in range(3):
-            pos[:, ii] = torch.fmod(
-                pos[:, ii], cell[ii]
-            )
-            loc = torch.where(torch.abs(pos[:, ii]) > cell[ii]/2)[0]
-            pos[loc, ii] += -1 * cell[ii] * pos[loc, ii].sign()
-        return pos
+    def pbc_pos(pos: Tensor, cell=[10, 10, 10]) -> Tensor:  # TODO: generalize to non-cubic
+        cell = torch.as_tensor(cell, dtype=pos.dtype, device=pos.device)
+        return pos - cell * torch.round(pos / cell)
+
+    def get_pbc_graph(
+        self, pos: Tensor, cell: Tensor, natoms: Tensor
+    ) -> Tuple[Tensor, Tensor, Tensor]:
+        r"""Periodic radius graph. With pbc_graph_resolution set, the graph of the
+        previous call is reused while natoms and the positions rounded to that
+        grid are unchanged, which is the case for most adjacent denoising steps.
+
+        Args:
+            pos (Tensor): [n_nodes, 3], positions
+            cell (Tensor): [n_sample, 3, 3], cells
+            natoms (Tensor): [n_sample], number of atoms per sample
+
+        Returns:
+            Tuple[Tensor, Tensor, Tensor]: edge index, cell offsets and
+                number of neighbors, as from radius_graph_pbc
+        """
+        key = None
+        if self.pbc_graph_resolution is not None:
+            grid = torch.round(pos.detach() / self.pbc_graph_resolution).to(torch.int32)
+            key = (tuple(natoms.tolist()), grid.cpu().numpy().tobytes())
+            if self._pbc_graph_cache is not None and self._pbc_graph_cache[0] == key:
+                return self._pbc_graph_cache[1]
+
+        graph = radius_graph_pbc(
+            pos=pos,
+            cell=cell,
+            natoms=natoms,
+            radius=self.model.cutoff,
+            max_num_neighbors_threshold=50,
+        )
+        if key is not None:
+            self._pbc_graph_cache = (key, graph)
+        return graph
 
     @staticmethod
     def compute_frag_index(n_frag_switch: Tensor) -> np.ndarray:
-        counts = [
-            torch.where(n_frag_switch == ii)[0].numel()
-            for ii in torch.unique(n_frag_switch)
-        ]
-        return np.concatenate([np.array([0]), np.cumsum(counts)])
+        counts = torch.bincount(n_frag_switch.long())
+        return torch.cat(
+            [torch.zeros(1, dtype=counts.dtype, device=counts.device), counts.cumsum(0)]
+        ).cpu().numpy()
+
+    def get_frag_index(self, n_frag_switch: Tensor) -> np.ndarray:
+        r"""Fragment offsets, reused while the same switch tensor is passed
+        across denoising steps."""
+        if self._frag_index_cache is None or self._frag_index_cache[0] is not n_frag_switch:
+            self._frag_index_cache = (
+                n_frag_switch,
+                self.compute_frag_index(n_frag_switch),
+            )
+        return self._frag_index_cache[1]
 
     @torch.no_grad()
     def adjust_edge_attr_on_new_eij(
@@ -269,70 +384,59 @@ class EGNNDynamics(BaseDynamics):
         Returns:
             Tensor: new e_ij
         """
-        edge_index_T = torch.transpose(edge_index, 1, 0)
-        edge_index_new_T = torch.transpose(edge_index_new, 1, 0)
-
-        edge_attr_new = []
-        for _ind, ij in enumerate(edge_index_new_T):
-            ind = torch.where((ij == edge_index_T).all(dim=1))[0]
-            if ind.size(0) > 1:
-                raise ValueError(f"ind should only be 0 or 1, getting {ind}")
-
-            if ind.size(0) == 0:
-                self.create_new_edge_attr(
-                    ind_new=_ind,
-                    ij_new=ij,
-                    edge_index_new_T=edge_index_new_T,
-                    edge_attr_new=edge_attr_new,
-                    edge_attr=edge_attr,
-                )
-            else:
-                edge_attr_new.append(edge_attr[ind.item()].detach())
-        return torch.stack(edge_attr_new, dim=0)
+        n_nodes = int(torch.cat([edge_index.flatten(), edge_index_new.flatten()]).max()) + 1
+        old_keys = edge_index[0] * n_nodes + edge_index[1]
+        new_keys = edge_index_new[0] * n_nodes + edge_index_new[1]
+        sorted_old, perm_old = old_keys.sort()
+
+        ind, n_match = self.search_keys(sorted_old, new_keys)
+        if (n_match > 1).any():
+            raise ValueError(f"ind should only be 0 or 1, getting {n_match.max().item()}")
+        found = n_match == 1
+        edge_attr_new = edge_attr.new_empty((new_keys.size(0),) + edge_attr.shape[1:])
+        edge_attr_new[found] = edge_attr[perm_old[ind[found]]].detach()
+
+        missing = torch.where(~found)[0]
+        if missing.numel() > 0:
+            # ij not present in old connections: reuse e_ji if ji comes earlier
+            # in the new indexes, otherwise initialize a new one.
+            sorted_new, perm_new = new_keys.sort()
+            reverse_keys = edge_index_new[1, missing] * n_nodes + edge_index_new[0, missing]
+            ind_reverse, n_match_reverse = self.search_keys(sorted_new, reverse_keys)
+            if (n_match_reverse == 0).any():
+                raise ValueError("should always find a reverse ind.")
+            ind_reverse = perm_new[ind_reverse]
+            is_first = ind_reverse >= missing
+            edge_attr_new[missing[is_first]] = self.init_edge_attr(
+                edge_attr_new[missing[is_first]]
+            )
+            edge_attr_new[missing[~is_first]] = edge_attr_new[ind_reverse[~is_first]]
+        return edge_attr_new
 
     @staticmethod
-    def init_edge_attr(sample_edge_attr):
-        r"""initialize edge attributes."""
-        return torch.rand_like(sample_edge_attr)
-
-    def create_new_edge_attr(
-        self,
-        ind_new: Tensor,
-        ij_new: Tensor,
-        edge_index_new_T: Tensor,
-        edge_attr_new: List[Tensor],
-        edge_attr: Tensor,
-    ) -> List[Tensor]:
-        r"""Create new edge attrbution for ij that is not present in old connections
+    def search_keys(sorted_keys: Tensor, keys: Tensor) -> Tuple[Tensor, Tensor]:
+        r"""Locate keys in a sorted key tensor.
 
         Args:
-            ind_new (Tensor): natural index of new ij
-            ij_new (Tensor): new ij
-            edge_index_new_T (Tensor): new edge indexes, [n_edge, 2]
-            edge_attr_new (List[Tensor]): list of new edge attributes
-            edge_attr (Tensor): old edge attributes
-
-        Raises:
-            ValueError: not ji found for ij in new indexes
+            sorted_keys (Tensor): [n_sorted], ascending keys to search in
+            keys (Tensor): [n_keys], keys to look up
 
         Returns:
-            List[Tensor]: list of new edge attributes
+            Tuple[Tensor, Tensor]: first position of each key in sorted_keys and
+                the number of times it occurs
         """
-        ij_new_reverse = ij_new[torch.tensor([1, 0])]
-        ind_new_reverse = torch.where(
-            (ij_new_reverse == edge_index_new_T).all(dim=1))[0]
-        print(ind_new_reverse)
-        if ind_new_reverse.size(0) == 0:
-            raise ValueError(f"should always find a reverse ind.")
-        # print(ij_new, ind_new, ind_new_reverse)
-        if ind_new_reverse.item() >= ind_new:
-            edge_attr_new.append(self.init_edge_attr(edge_attr[0]))
-        else:
-            edge_attr_new.append(edge_attr_new[ind_new_reverse.item()])
-        return edge_attr_new
+        ind = torch.searchsorted(sorted_keys, keys)
+        n_match = torch.searchsorted(sorted_keys, keys, right=True) - ind
+        return ind, n_match
+
+    @staticmethod
+    def init_edge_attr(sample_edge_attr):
+        r"""initialize edge attributes."""
+        return torch.rand_like(sample_edge_attr)
 
     @staticmethod
     def remove_mean_batch(x, indices):
-        mean = scatter_mean(x, indices, dim=0)
+        # indices come from get_mask_for_frag and are sorted within a fragment.
+        mean = segment_coo(x, indices, reduce="mean")
         x = x - mean[indices]
         return x
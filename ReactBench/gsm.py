@@ -2,10 +2,37 @@
 # Author: Qiyuan Zhao (zhaoqy1996@gmail.com)
 import subprocess
 import os
+import re
+import shutil
 import time
 
+import numpy as np
+
 from ReactBench.utils.parsers import xyz_parse
 
+# pyGSM writes scratch/opt_iters_{ID:03}_{iteration}.xyz
+_OPT_ITERS_RE = re.compile(r'opt_iters_(?:\w*_)?(\d+)\.xyz$')
+
+
+def _tail_lines(path, block=65536):
+    """Yield the lines of a text file from last to first.
+
+    The file is read backwards in blocks of ``block`` bytes so that the
+    markers near the end of a long pyGSM log are found without loading it.
+    """
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = b''
+        while position > 0:
+            size = min(block, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + remainder).split(b'\n')
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                yield line.decode('utf-8')
+        yield remainder.decode('utf-8')
+
 
 class PYGSM:
     def __init__(self, input_geo, work_folder=os.getcwd(), calc= 'leftnet', jobname='gsmjob', jobid=1, nprocs=1, num_nodes=9, max_gsm_iters=100,
@@ -50,27 +77,25 @@ class PYGSM:
         # Generate command
         current_file_path = os.path.dirname(os.path.abspath(__file__))
         run_pygsm_path = os.path.join(current_file_path, "utils/run_pygsm.py")
-        cmd_parts = [
-            f"OMP_NUM_THREADS={nprocs} {python_exe} {run_pygsm_path}",
-            f"-xyzfile {input_geo}",
-            f"-calc {calc}",
-            f"-ID {jobid}",
-            f"-num_nodes {num_nodes}",
-            f"-nproc {nprocs}",
-            f"-max_gsm_iters {max_gsm_iters}",
-            f"-max_opt_steps {max_opt_steps}",
-            f"-DMAX {dmax}",
-            f"-ADD_NODE_TOL {add_node_tol}",
-            f"-CONV_TOL {conv_tol}",
-            f"-info {info_str}"
+        self.cmd_argv = [
+            python_exe, run_pygsm_path,
+            '-xyzfile', str(input_geo),
+            '-calc', str(calc),
+            '-ID', str(jobid),
+            '-num_nodes', str(num_nodes),
+            '-nproc', str(nprocs),
+            '-max_gsm_iters', str(max_gsm_iters),
+            '-max_opt_steps', str(max_opt_steps),
+            '-DMAX', str(dmax),
+            '-ADD_NODE_TOL', str(add_node_tol),
+            '-CONV_TOL', str(conv_tol),
+            '-info', info_str,
         ]
         
         if reactant_geom_fixed:
-            cmd_parts.append('-reactant_geom_fixed')
+            self.cmd_argv.append('-reactant_geom_fixed')
         if product_geom_fixed:
-            cmd_parts.append('-product_geom_fixed')
-            
-        self.command = ' '.join(cmd_parts)
+            self.cmd_argv.append('-product_geom_fixed')
 
     def prepare_job(self):
         """Prepare GSM job by setting up working directory and input files."""
@@ -78,16 +103,19 @@ class PYGSM:
         os.makedirs(f'{self.work_folder}/scratch', exist_ok=True)
             
         # Copy input geometry to scratch
-        os.system(f'cp {self.input_geo} {self.work_folder}/scratch/initial{self.jobid:03d}.xyz')
+        shutil.copy(self.input_geo, f'{self.work_folder}/scratch/initial{self.jobid:03d}.xyz')
         
         # Handle restart if needed
         if self.restart:
-            opt_strings = [f for f in os.listdir(f'{self.work_folder}/scratch') if 'opt_iters_' in f]
-            if opt_strings:
-                last_ind = max(int(f.split('.xyz')[0].split('_')[-1]) for f in opt_strings)
-                restart_string = [f for f in opt_strings if int(f.split('.xyz')[0].split('_')[-1])==last_ind][0]
-                os.system(f'cp {self.work_folder}/scratch/{restart_string} {self.work_folder}/restart.xyz')            
-                self.command += f' -restart_file {self.work_folder}/restart.xyz'
+            last_iter, restart_string = -1, None
+            with os.scandir(f'{self.work_folder}/scratch') as entries:
+                for entry in entries:
+                    match = _OPT_ITERS_RE.search(entry.name)
+                    if match and int(match.group(1)) > last_iter:
+                        last_iter, restart_string = int(match.group(1)), entry.name
+            if restart_string is not None:
+                shutil.copy(f'{self.work_folder}/scratch/{restart_string}', f'{self.work_folder}/restart.xyz')
+                self.cmd_argv += ['-restart_file', f'{self.work_folder}/restart.xyz']
                 
         print(f"Finished preparing working environment for pyGSM job {self.jobname}")
 
@@ -113,41 +141,37 @@ class PYGSM:
         try:
             os.chdir(self.work_folder)
             env = os.environ.copy()
-            env['OMP_NUM_THREADS'] = '1'
+            env['OMP_NUM_THREADS'] = str(self.nprocs)
             
-            start_time = time.time()
+            start_time = time.monotonic()
             process = subprocess.Popen(
-                self.command,
+                self.cmd_argv,
                 stdout=open(self.output, 'w'),
                 stderr=open(self.errlog, 'w'),
-                shell=True,
+                shell=False,
                 env=env,
                 cwd=self.work_folder,
             )
 
-            while True:
-                if process.poll() is not None:
-                    result = subprocess.CompletedProcess(
-                        args=self.command,
-                        returncode=process.returncode,
-                        stdout='',
-                        stderr='Check error.log for details.'
-                    )
-                    break
-                    
-                if time.time() - start_time > timeout:
-                    process.kill()
-                    result = subprocess.CompletedProcess(
-                        args=self.command,
-                        returncode=1,
-                        stdout='',
-                        stderr=f"pyGSM job {self.jobname} timed out"
-                    )
-                    break
-                    
-                time.sleep(1)
+            try:
+                process.wait(timeout=timeout)
+                result = subprocess.CompletedProcess(
+                    args=self.cmd_argv,
+                    returncode=process.returncode,
+                    stdout='',
+                    stderr='Check error.log for details.'
+                )
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+                result = subprocess.CompletedProcess(
+                    args=self.cmd_argv,
+                    returncode=1,
+                    stdout='',
+                    stderr=f"pyGSM job {self.jobname} timed out"
+                )
 
-            execution_time = time.time() - start_time
+            execution_time = time.monotonic() - start_time
 
             if result.returncode == 0:
                 msg = f"GSM job {self.jobname} finished in {execution_time:.1f}s"
@@ -169,10 +193,9 @@ class PYGSM:
         if not os.path.isfile(self.output):
             return False
 
-        with open(self.output, 'r', encoding="utf-8") as f:
-            for line in reversed(f.readlines()):
-                if any(marker in line for marker in ['Printing string to', 'Finished GSM!', 'error']):
-                    return True
+        for line in _tail_lines(self.output):
+            if any(marker in line for marker in ['Printing string to', 'Finished GSM!', 'error']):
+                return True
         return False
 
     def calculation_terminated_successfully(self) -> bool:
@@ -184,10 +207,9 @@ class PYGSM:
         if not os.path.isfile(self.output):
             return False
 
-        with open(self.output, 'r', encoding="utf-8") as f:
-            for line in reversed(f.readlines()):
-                if 'Finished GSM!' in line:
-                    return True
+        for line in _tail_lines(self.output):
+            if 'Finished GSM!' in line:
+                return True
         return False
 
     def find_correct_TS(self, tight=True) -> int:
@@ -201,19 +223,16 @@ class PYGSM:
         if not self.calculation_terminated_successfully():
             return False
             
-        with open(self.output, 'r', encoding="utf-8") as f:
-            lines = f.readlines()
-            
-        energies = []
-        for line in reversed(lines):
+        energies = np.zeros(0)
+        for line in _tail_lines(self.output):
             if 'V_profile:' in line:
-                energies = [float(i) for i in line.split()[1:]]
+                energies = np.fromiter((float(i) for i in line.split()[1:]), dtype=np.float64)
                 break
         
         if len(energies) < 5:
             return False
 
-        if max(energies) > 1000:
+        if energies.max() > 1000:
             return False
         
         peaks = []
@@ -223,11 +242,10 @@ class PYGSM:
         if energies[-2] > max(energies[-1], energies[-3], energies[-4]):
             peaks.append(len(energies)-2)
             
-        # Check internal points
-        for i in range(2, len(energies) - 2):
-            if (energies[i] > max(energies[i-1], energies[i-2]) and 
-                energies[i] > max(energies[i+1], energies[i+2])):
-                peaks.append(i)
+        # Check internal points against their two neighbours on each side
+        inner = energies[2:-2]
+        is_peak = (inner > energies[1:-3]) & (inner > energies[:-4]) & (inner > energies[3:-1]) & (inner > energies[4:])
+        peaks += (np.flatnonzero(is_peak) + 2).tolist()
 
         # check and return peak
         if not peaks:
@@ -240,7 +258,7 @@ class PYGSM:
                 return False
             else:
                 # Find the peak with the maximum energy
-                return max(peaks, key=lambda ind: energies[ind])
+                return peaks[int(np.argmax(energies[peaks]))]
                     
 
     def get_strings(self):
@@ -253,7 +271,10 @@ class PYGSM:
         if os.path.exists(strings_xyz):
             return xyz_parse(strings_xyz, multiple=True)
         else:
-            strings_xyz = [os.path.join(self.work_folder,i) for i in os.listdir(f'{self.work_folder}') if 'opt_converged_' in i][0]
+            with os.scandir(self.work_folder) as entries:
+                strings_xyz = next((entry.path for entry in entries if 'opt_converged_' in entry.name), None)
+            if strings_xyz is None:
+                return False
             return xyz_parse(strings_xyz, multiple=True)
         
 
@@ -3,41 +3,39 @@ This module contains the find_lewis() function and associated helper functions t
 best resonance structures for yarpecules.
 """
 
-import sys
+import os
 import itertools
 import numpy as np
-from copy import copy,deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache,partial
 
 from ReactBench.utils.taffi_functions import adjmat_to_adjlist,return_rings,graph_seps
 from ReactBench.utils.properties import el_valence,el_n_deficient,el_expand_octet,el_en,el_pol,el_n_expand_octet,el_metals
 
 
-
-
-
-def bmat_hash(bond_mat):
+def bmat_key(bond_mat):
     """ 
-    Creates a unique hash value for each bond-electron matrix that is used to speed uniqueness checks.
+    Creates a unique key for each bond-electron matrix that is used to speed uniqueness checks.
     
     Parameters
     ----------
     bond_mat : array
-               The bond electron matrix that the hash is calculated for.
+               The bond electron matrix that the key is calculated for.
     
     Returns
     -------
-    hash_value: float
+    key: bytes
     
 
     Notes
     -----            
-    The hash is calculated as bond_mat * an ascending array (1,2,... counting up through all elements and rows) summed over rows, 
-    then those values are multiplied by 10**(-i/100) where i is the column, and summed.
+    The key is the raw bytes of the matrix entries stored as int8 (bond orders and electron counts are small integers). 
+    It is exact, so distinct matrices never collide, and hashing/comparing bytes in a set is done entirely in C.
     """
-    return np.sum([ _*10**(-(count/100)) for count,_ in enumerate(np.sum(bond_mat*np.arange(1,len(bond_mat)**2+1).reshape(len(bond_mat),len(bond_mat)),axis=0)) ])            
+    return bond_mat.astype(np.int8,copy=False).tobytes()
 
 
-def find_lewis(elements,adj_mat,q=0,rings=None,mats_max=10,mats_thresh=10.0,w_def=-2,w_exp=0.1,w_formal=0.1,w_aro=-10,w_rad=0.1,w_zwitter=0.1,w_ionic=5.0,local_opt=True):
+def find_lewis(elements,adj_mat,q=0,rings=None,mats_max=10,mats_thresh=10.0,w_def=-2,w_exp=0.1,w_formal=0.1,w_aro=-10,w_rad=0.1,w_zwitter=0.1,w_ionic=5.0,local_opt=True,n_jobs=1):
 
     """ 
     Algorithm for finding relevant Lewis Structures of a molecular graph given an overall charge.
@@ -81,6 +79,10 @@ def find_lewis(elements,adj_mat,q=0,rings=None,mats_max=10,mats_thresh=10.0,w_de
     local_opt: boolean, default=True
                This controls whether non-local charge transfers are allowed (False). This can be expensive. 
 
+    n_jobs: int, default=1
+            Number of worker processes used by `gen_init()` to generate the initial guesses of charged molecules and to rescore the 
+            structures found from them (-1 uses all cores). Only worthwhile when there are many initial guesses (e.g., |q| >= 2).
+
     Returns
     -------
     bond_mats : list
@@ -90,32 +92,33 @@ def find_lewis(elements,adj_mat,q=0,rings=None,mats_max=10,mats_thresh=10.0,w_de
             A list of scores for each bond-electon matrix within bond_mats.
         
     """
-    old_rec_limit =sys.getrecursionlimit()
-    sys.setrecursionlimit(5000)            
-
-    # Array of atom-wise octet requirements for determining electron deficiencies
-    e_def = np.array([ el_n_deficient[_] for _ in elements ])
+    # Bond orders and electron counts are small integers, so bond-electron matrices are stored as int8 to keep the many copies made during the search cheap.
+    # Connectivity that doesn't fit is rejected before narrowing (the electron counts are checked by gen_init()).
+    adj_mat = np.asarray(adj_mat)
+    if adj_mat.size and ( adj_mat.min() < 0 or adj_mat.max() > 127 ):
+        raise LewisStructureError("Bond orders or electron counts exceed the int8 range of the bond-electron matrices.")
+    adj_mat = np.ascontiguousarray(adj_mat,dtype=np.int8)
 
-    # Array of atom-wise octet requirements for determining expanded octects 
-    e_exp = np.array([ el_n_expand_octet[_] for _ in elements ])
+    # Arrays of atom-wise electroneutral electron counts, octet requirements for determining electron deficiencies and 
+    # expanded octets, and base electronegativities
+    eneutral,e_def,e_exp,en = element_arrays(tuple(elements))
 
     # Generate rings if they weren't supplied. Needed to determine allowed double bonds in rings and resonance
-    if not rings: rings = return_rings(adjmat_to_adjlist(adj_mat),max_size=10,remove_fused=True)
+    if not rings: rings = [ list(_) for _ in graph_rings(adj_mat.tobytes(),len(adj_mat)) ]
 
     # Get the indices of atoms in rings < 10 (used to determine if multiple double bonds and alkynes are allowed on an atom)
     ring_atoms = { j for i in [ _ for _ in rings if len(_) < 10 ] for j in i }
 
     # Get the indices of bridgehead atoms whose largest parent ring is smaller than 8 (i.e., Bredt's rule says no double-bond can form at such bridgeheads)
-    bredt_rings = [ set(_) for _ in rings if len(_) < 8 ]
-    bridgeheads = []
-    if len(bredt_rings) > 2:
-        for r in itertools.combinations(bredt_rings,3):
-            bridgeheads += list(r[0].intersection(r[1].intersection(r[2]))) # bridgeheads are atoms in at least three rings. 
-    bridgeheads = set(bridgeheads)
+    bredt_rings = [ list(set(_)) for _ in rings if len(_) < 8 ]
+    ring_membership = np.zeros([len(elements),len(bredt_rings)],dtype=bool)
+    for count,r in enumerate(bredt_rings):
+        ring_membership[r,count] = True
+    bridgeheads = set(np.flatnonzero(ring_membership.sum(axis=1) >= 3).tolist()) # bridgeheads are atoms in at least three rings. 
 
     # Get the graph separations if local_opt = True
     if local_opt:
-        seps = graph_seps(adj_mat)
+        seps = cached_graph_seps(adj_mat.tobytes(),len(adj_mat))
     # using seps=0 is equivalent to allowing all charge transfers (i.e., all atoms are treated as nearby)
     else:
         seps = np.zeros([len(elements),len(elements)])
@@ -123,41 +126,49 @@ def find_lewis(elements,adj_mat,q=0,rings=None,mats_max=10,mats_thresh=10.0,w_de
     # Initialize lists to hold bond_mats and scores
     bond_mats = []
     scores = []
-    hashes = set([])
+    hashes = set()
     
-    # Initialize score function for ranking bond_mats
-    en = np.array([ el_en[_] for _ in elements ]) # base electronegativities of each atom
-    rad_env = np.array([ el_en[_] for _ in elements ]) # base electronegativities of each atom
-
+    # Initialize score function for ranking bond_mats. The zero radical environment (and the zero graph separations used 
+    # for the initial guesses) are constant, so they are built once rather than on every call.
     factor = 0.0
+    no_rad_env = np.zeros(len(elements))
+    no_seps = np.zeros([len(elements),len(elements)])
     
-    obj_fun = lambda x: bmat_score(x,elements,rings,cat_en=en,an_en=en,rad_env=np.zeros(len(elements)),e_def=e_def,e_exp=e_exp,w_def=w_def,\
+    obj_fun = lambda x: bmat_score(x,elements,rings,cat_en=en,an_en=en,rad_env=no_rad_env,e_def=e_def,e_exp=e_exp,w_def=w_def,\
                                    w_exp=w_exp,w_formal=w_formal,w_aro=0,w_rad=w_rad,w_zwitter=w_zwitter,w_ionic=w_ionic,factor=factor,verbose=False) # aro term is turned off initially since it traps greedy optimization
     
     # Find the minimum bmat structure
     # gen_init() generates a series of initial guesses. For neutral molecules, this guess is singular. For charged molecules, it will yield all possible charge placements (expensive but safe).
+    # Each bond_mat records the reactive atoms of the initial guess it was generated from (bmat_reactive), so that the 
+    # resonance search below uses the reactive atoms that belong to its starting structure
     count = 0
-    for score,bond_mat,reactive in gen_init(obj_fun,adj_mat,elements,rings,q):
+    score_cache = {}
+    bmat_reactive = []
+    for score,bond_mat,reactive in gen_init(obj_fun,adj_mat,elements,rings,q,eneutral=eneutral,e_def=e_def,e_exp=e_exp,n_jobs=n_jobs):
         count += 1
-        if bmat_unique(bond_mat,bond_mats):
-            scores += [score]
-            bond_mats += [bond_mat]
-            hashes.add(bmat_hash(bond_mat))
-            bond_mats,scores,_,_,_ = gen_all_lstructs(obj_fun,bond_mats,scores,hashes,elements,reactive,rings,ring_atoms,bridgeheads,seps=np.zeros([len(elements),len(elements)]), min_score=scores[0], ind=len(bond_mats)-1,N_score=1000,N_max=10000,min_win=100.0,min_opt=True)
+        b_hash = bmat_key(bond_mat)
+        score_cache[b_hash] = score
+        if b_hash not in hashes:
+            scores.append(score)
+            bond_mats.append(bond_mat)
+            hashes.add(b_hash)
+            bond_mats,scores,_,_,_ = gen_all_lstructs(obj_fun,bond_mats,scores,hashes,elements,reactive,rings,ring_atoms,bridgeheads,seps=no_seps, min_score=scores[0], ind=len(bond_mats)-1,N_score=1000,N_max=10000,min_win=100.0,min_opt=True,score_cache=score_cache)
+            bmat_reactive.extend([reactive]*(len(bond_mats)-len(bmat_reactive)))
     # Update objective function to include (anti)aromaticity considerations and update scores of the current bmats
-    obj_fun = lambda x: bmat_score(x,elements,rings,cat_en=en,an_en=en,rad_env=np.zeros(len(elements)),e_def=e_def,e_exp=e_exp,w_def=w_def,w_exp=w_exp,w_formal=w_formal,\
-                                   w_aro=w_aro,w_rad=w_rad,w_zwitter=w_zwitter,w_ionic=w_ionic,factor=factor,verbose=False)                        
-    scores = [ obj_fun(_) for _ in bond_mats ]            
+    # (a partial rather than a lambda, so that it can be sent to worker processes when n_jobs != 1)
+    obj_fun = partial(bmat_score,elements=elements,rings=rings,cat_en=en,an_en=en,rad_env=no_rad_env,e_def=e_def,e_exp=e_exp,w_def=w_def,w_exp=w_exp,w_formal=w_formal,\
+                      w_aro=w_aro,w_rad=w_rad,w_zwitter=w_zwitter,w_ionic=w_ionic,factor=factor,verbose=False)                        
+    # These scores also seed the score cache of the search below, which uses the same objective function
+    scores = list(parallel_map(obj_fun,bond_mats,n_jobs))
+    score_cache = { bmat_key(b):score for b,score in zip(bond_mats,scores) }
             
-    # Sort by initial scores
-    bond_mats = [ _[1] for _ in sorted(zip(scores,bond_mats),key=lambda x:x[0]) ]
-    scores = sorted(scores)
-    
     # Generate resonance structures: Run starting from the minimum structure and allow moves that are within s_window of the min_enegy score
-    bond_mats=[bond_mats[0]]    
-    scores = [scores[0]]
-    hashes = set([bmat_hash(bond_mats[0])])
-    bond_mats,scores,hashes,_,_ = gen_all_lstructs(obj_fun,bond_mats, scores, hashes, elements, reactive, rings, ring_atoms, bridgeheads, seps, min_score=min(scores), ind=len(bond_mats)-1,N_score=1000,N_max=10000,min_opt=True)
+    best = int(np.argmin(scores)) if scores else 0 # first structure with the lowest initial score
+    bond_mats = [bond_mats[best]]    
+    scores = [scores[best]]
+    reactive = bmat_reactive[best]
+    hashes = set([bmat_key(bond_mats[0])])
+    bond_mats,scores,hashes,_,_ = gen_all_lstructs(obj_fun,bond_mats, scores, hashes, elements, reactive, rings, ring_atoms, bridgeheads, seps, min_score=min(scores), ind=len(bond_mats)-1,N_score=1000,N_max=10000,min_opt=True,score_cache=score_cache)
     
     # Sort by initial scores
     inds = np.argsort(scores)
@@ -177,15 +188,16 @@ def find_lewis(elements,adj_mat,q=0,rings=None,mats_max=10,mats_thresh=10.0,w_de
             break
     if flag:
         count += 1
-    # Shed the excess b_mats
-    bond_mats = bond_mats[:count]
+    # Shed the excess b_mats. The kept ones are stacked into a compact (count,n,n) array, which releases the search buffer
+    bond_mats = np.stack(bond_mats[:count])
     scores = scores[:count]
 
     # Calculate the number of charge centers bonded to each atom (determines hybridization)
     # calculated as: number of bonded_atoms + number of unbound electron orbitals (pairs or radicals).
     # The latter is calculated as the minimum value over all relevant bond_mats (e.g., ester oxygen, R-O(C=O)-R will only have one lone pair not two in this calculation)
-    centers = [ i+np.ceil(min([ b[count,count] for b in bond_mats ])*0.5) for count,i in enumerate(sum(adj_mat)) ] # finds the number of charge centers bonded to each atom (determines hybridization) 
-    s_char = np.array([ 1/(_+0.0001) for _ in centers ]) # need s-character to assign positions of anions for precisely
+    min_lone = bond_mats.diagonal(axis1=1,axis2=2).min(axis=0)
+    centers = adj_mat.sum(axis=0) + np.ceil(min_lone*0.5) # finds the number of charge centers bonded to each atom (determines hybridization) 
+    s_char = 1/(centers+0.0001) # need s-character to assign positions of anions for precisely
     pol = np.array([ el_pol[_] for _ in elements ]) # polarizability of each atom
 
     # Calculate final scores. For finding the preferred position of formal charges, some small corrections are made to the electronegativities of anion and cations based on neighboring atoms and hybridization.
@@ -197,18 +209,108 @@ def find_lewis(elements,adj_mat,q=0,rings=None,mats_max=10,mats_thresh=10.0,w_de
         
     # Sort by final scores
     inds = np.argsort(scores)
-    bond_mats = [ bond_mats[_] for _ in inds ]
+    bond_mats = list(bond_mats[inds])
     scores = [ scores[_] for _ in inds ]
-    sys.setrecursionlimit(old_rec_limit)
     return bond_mats,scores
 
+@lru_cache(maxsize=256)
+def element_arrays(elements):
+    """
+    Returns the atom-wise property arrays used throughout find_lewis(). Cached on the tuple of elements, since
+    find_lewis() is typically called repeatedly for the same molecule (e.g., reactant/product pairs and geometries).
+
+    Parameters
+    ----------
+    elements : tuple
+               Contains the elemental symbols of the molecule.
+
+    Returns
+    -------
+    eneutral, e_def, e_exp, en : arrays
+               Electroneutral electron counts, octet requirements for determining electron deficiencies and 
+               expanded octets, and base electronegativities of each atom. The arrays are read-only since they are shared.
+    """
+    arrays = (np.array([ el_valence[_] for _ in elements ]),
+              np.array([ el_n_deficient[_] for _ in elements ]),
+              np.array([ el_n_expand_octet[_] for _ in elements ]),
+              np.array([ el_en[_] for _ in elements ]))
+    for _ in arrays:
+        _.setflags(write=False)
+    return arrays
+
+@lru_cache(maxsize=256)
+def element_flags(elements):
+    """
+    Returns the atom-wise boolean properties used throughout find_lewis(). Cached on the tuple of elements like `element_arrays()`.
+
+    Parameters
+    ----------
+    elements : tuple
+               Contains the elemental symbols of the molecule.
+
+    Returns
+    -------
+    expand_octet, metals, oxygens, hydrogens : arrays
+               Whether each atom can expand its octet, whether it is a metal, and which atoms are the 'O' and 'H' labels checked by 
+               `ionic_penalty()`. The arrays are read-only since they are shared.
+    """
+    arrays = (np.array([ el_expand_octet[_] for _ in elements ],dtype=bool),
+              np.array([ _ in el_metals for _ in elements ],dtype=bool),
+              np.array([ _ == 'O' for _ in elements ],dtype=bool),
+              np.array([ _ == 'H' for _ in elements ],dtype=bool))
+    for _ in arrays:
+        _.setflags(write=False)
+    return arrays
+
+@lru_cache(maxsize=256)
+def element_scalars(elements):
+    """
+    Returns the atom-wise properties read by `valid_moves()` as tuples of python scalars, which are indexed one atom at a time in 
+    its move checks. Cached on the tuple of elements like `element_arrays()`, so they are only converted once per molecule rather 
+    than for every bond-electron matrix that is expanded during the search.
+
+    Parameters
+    ----------
+    elements : tuple
+               Contains the elemental symbols of the molecule.
+
+    Returns
+    -------
+    n_def, expand_octet, en : tuples
+               Octet requirements for determining electron deficiencies, whether each atom can expand its octet, and base 
+               electronegativities of each atom.
+    """
+    _,e_def,_,en = element_arrays(elements)
+    return tuple(e_def.tolist()),tuple(element_flags(elements)[0].tolist()),tuple(en.tolist())
+
+# The ring perception and graphical separations only depend on the molecular graph, which typically recurs across
+# find_lewis() calls (e.g., several charge states or geometries of the same species). The graph is passed as the bytes 
+# of the int8 adjacency matrix so that it can serve as the cache key.
+@lru_cache(maxsize=1024)
+def graph_rings(adj_key,n):
+    """
+    Returns the rings (up to size 10, fused rings removed) of the graph held by the int8 adjacency matrix bytes `adj_key`
+    as a tuple of tuples. 
+    """
+    adj_mat = np.frombuffer(adj_key,dtype=np.int8).reshape(n,n)
+    return tuple( tuple(_) for _ in return_rings(adjmat_to_adjlist(adj_mat),max_size=10,remove_fused=True) )
+
+@lru_cache(maxsize=1024)
+def cached_graph_seps(adj_key,n):
+    """
+    Returns the (read-only) graphical separations of the graph held by the int8 adjacency matrix bytes `adj_key`.
+    """
+    seps = graph_seps(np.frombuffer(adj_key,dtype=np.int8).reshape(n,n))
+    seps.setflags(write=False)
+    return seps
+
 class LewisStructureError(Exception):
 
     def __init__(self, message="An error occured in a find_lewis() call."):
         self.message = message
         super().__init__(self.message)      
         
-def gen_init(obj_fun,adj_mat,elements,rings,q):
+def gen_init(obj_fun,adj_mat,elements,rings,q,eneutral=None,e_def=None,e_exp=None,n_jobs=1):
 
     """ 
     A helper-generator for initial guesses for the final_lewis algorithm.
@@ -230,6 +332,14 @@ def gen_init(obj_fun,adj_mat,elements,rings,q):
     q : int
         Sets the overall charge for the molecule. 
 
+    eneutral, e_def, e_exp : arrays, default=None
+        Atom-wise electroneutral electron counts and the octet requirements for deficiencies and expanded octets. 
+        Looked up via `element_arrays()` when not supplied.
+
+    n_jobs : int, default=1
+        Number of worker processes used to saturate the charged initial guesses (see `map_saturate_bonds()`). 
+        The guesses are independent, so for |q| >= 2 on larger molecules this phase parallelizes well.
+
     Yields
     -------
     iterator: tuple
@@ -237,43 +347,48 @@ def gen_init(obj_fun,adj_mat,elements,rings,q):
               containing the score of the initial guess, the bond-electron matrix, and the list of reactive indices.
     """
     
-    # Array of atom-wise electroneutral electron expectations for convenience.
-    eneutral = np.array([ el_valence[_] for _ in elements ])    
-
-    # Array of atom-wise octet requirements for determining electron deficiencies
-    e_def = np.array([ el_n_deficient[_] for _ in elements ])
-
-    # Array of atom-wise octet requirements for determining expanded octects 
-    e_exp = np.array([ el_n_expand_octet[_] for _ in elements ])
+    # Arrays of atom-wise electroneutral electron expectations and octet requirements (deficient/expanded)
+    if eneutral is None or e_def is None or e_exp is None:
+        eneutral,e_def,e_exp,_ = element_arrays(tuple(elements))
     
-    # Initial neutral bond electron matrix with sigma bonds in place
-    bond_mat = deepcopy(adj_mat) + np.diag(np.array([ _ - sum(adj_mat[count]) for count,_ in enumerate(eneutral) ]))
+    # The bond_mats are stored as int8 (see find_lewis()). The unbound electrons of an atom start at its electroneutral count 
+    # less its sigma bonds, and placing the charge of an anion can add up to |q| electrons to a single atom, so molecules that 
+    # could exceed the int8 range are rejected here rather than silently wrapping around
+    lone = eneutral - adj_mat.sum(axis=1)
+    if adj_mat.size and ( adj_mat.min() < 0 or adj_mat.max() > 127 or lone.min() < -128 or lone.max() + max(-q,0) > 127 ):
+        raise LewisStructureError("Bond orders or electron counts exceed the int8 range of the bond-electron matrices.")
 
-    # Correct metal atoms (remove formed bonds)
-    bond_mat_tmp = deepcopy(bond_mat)
+    # Initial neutral bond electron matrix with sigma bonds in place
+    # (the unbound electrons are added in place on the diagonal rather than through a dense np.diag() matrix)
+    bond_mat = adj_mat.astype(np.int8)
+    bond_mat[np.diag_indices_from(bond_mat)] += lone.astype(np.int8)
+
+    # Correct metal atoms (remove formed bonds). The metals and their bonded atoms are found with vectorized scans 
+    # (element_flags() is cached per molecule)
+    expand_octet,metals,_,_ = element_flags(tuple(elements))
+    bond_mat_tmp = bond_mat.copy()
     corrs = []
-    for count_i,i in enumerate(elements):
-        if i in el_metals:
-            for count_j,j in enumerate(bond_mat[count_i]):
-                if count_i != count_j and j > 0:
-                    bond_mat_tmp[count_i,count_j] += -1
-                    bond_mat_tmp[count_j,count_i] += -1
-                    bond_mat_tmp[count_i,count_i] += 1
-                    bond_mat_tmp[count_j,count_j] += 1                    
-                    corrs += [(-1,count_i,count_j),(-1,count_j,count_i),(1,count_i,count_i),(1,count_j,count_j)]
+    for count_i in np.flatnonzero(metals).tolist():
+        for count_j in np.flatnonzero(bond_mat[count_i] > 0).tolist():
+            if count_i != count_j:
+                bond_mat_tmp[count_i,count_j] += -1
+                bond_mat_tmp[count_j,count_i] += -1
+                bond_mat_tmp[count_i,count_i] += 1
+                bond_mat_tmp[count_j,count_j] += 1                    
+                corrs.extend([(-1,count_i,count_j),(-1,count_j,count_i),(1,count_i,count_i),(1,count_j,count_j)])
     bond_mat = bond_mat_tmp
 
     # Correct atoms with negative charge using q (if anions)
     qeff = q        
-    n_ind = [ _ for _ in range(len(bond_mat)) if bond_mat[_,_] < 0 ]
+    n_ind = np.flatnonzero(bond_mat.diagonal() < 0).tolist()
     while (len(n_ind)>0 and qeff<0):
         bond_mat[n_ind[0],n_ind[0]] += 1
         qeff += 1
-        n_ind = [ _ for _ in range(len(bond_mat)) if bond_mat[_,_] < 0 ]        
+        n_ind = np.flatnonzero(bond_mat.diagonal() < 0).tolist()        
 
     # Correct atoms with negative charge using lone electrons
-    n_ind = [ _ for _ in range(len(bond_mat)) if bond_mat[_,_] < 0 ]
-    l_ind = [ _ for _ in range(len(bond_mat)) if bond_mat[_,_] > 0 ] 
+    n_ind = np.flatnonzero(bond_mat.diagonal() < 0).tolist()
+    l_ind = np.flatnonzero(bond_mat.diagonal() > 0).tolist() 
     while (len(n_ind)>0 and len(l_ind)>0):
         for i in l_ind:
             try:
@@ -282,17 +397,20 @@ def gen_init(obj_fun,adj_mat,elements,rings,q):
                 bond_mat[i,i] -= 1
             except:
                 continue
-        n_ind = [ _ for _ in range(len(bond_mat)) if bond_mat[_,_] < 0 ]
-        l_ind = [ _ for _ in range(len(bond_mat)) if bond_mat[_,_] > 0 ] 
+        n_ind = np.flatnonzero(bond_mat.diagonal() < 0).tolist()
+        l_ind = np.flatnonzero(bond_mat.diagonal() > 0).tolist() 
 
     # Raise error if there are still negative charges on the diagonal
-    if len([ _ for _ in range(len(bond_mat)) if bond_mat[_,_] < 0 ]):
+    if ( bond_mat.diagonal() < 0 ).any():
         raise LewisStructureError("Incompatible charge state and adjacency matrix.")
 
     # Correct expanded octets if possible (while performs CT from atoms with expanded octets
     # to deficient atoms until there are no more expanded octets or no more deficient atoms)
-    e_ind = [ count for count,_ in enumerate(return_expanded(bond_mat,elements,e_exp)) if _ > 0 and bond_mat[count,count] > 0 ]
-    d_ind = [ count for count,_ in enumerate(return_def(bond_mat,elements,e_def)) if _ < 0 ]    
+    # The donors (expanded octets with unbound electrons) and acceptors (deficient atoms) come from one reduction
+    def ct_inds():
+        _,defs,exps = return_e_def_exp(bond_mat,e_def,e_exp)
+        return np.flatnonzero(( exps > 0 ) & ( bond_mat.diagonal() > 0 )).tolist(),np.flatnonzero(defs < 0).tolist()
+    e_ind,d_ind = ct_inds()
     while (len(e_ind)>0 and len(d_ind)>0):
         for i in e_ind:
             try:
@@ -301,8 +419,7 @@ def gen_init(obj_fun,adj_mat,elements,rings,q):
                 bond_mat[i,i] -= 1
             except:
                 continue
-        e_ind = [ count for count,_ in enumerate(return_expanded(bond_mat,elements,e_exp)) if _ > 0 and bond_mat[count,count] > 0 ]
-        d_ind = [ count for count,_ in enumerate(return_def(bond_mat,elements,e_def)) if _ < 0 ]    
+        e_ind,d_ind = ct_inds()
     
     # Get the indices of atoms in rings < 10 (used to determine if multiple double bonds and alkynes are allowed on an atom)
     ring_atoms = { j for i in [ _ for _ in rings if len(_) < 10 ] for j in i }
@@ -312,24 +429,23 @@ def gen_init(obj_fun,adj_mat,elements,rings,q):
 
         # Check the valency of the atoms to determine which can accept a charge
         e = return_e(bond_mat)
-        heavies = [ count for count,_ in enumerate(elements) if e[count] < el_n_deficient[_] or el_expand_octet[_] ]
-
-        # Loop over all q-combinations of heavy atoms
-        for i in itertools.combinations_with_replacement(heavies, int(abs(qeff))):
-
-            # Create a fresh copy of the initial be_mat and add charges
-            tmp = copy(bond_mat)
-            for _ in i: tmp[_,_] += 1
-
-            # Find reactive atoms (i.e., atoms with unbound electron(s) or deficient atoms or a formal charge)
-            e = return_e(tmp)
-            f = return_formals(tmp,elements)
-            reactive = [ count for count,_ in enumerate(elements) if ( tmp[count,count] or e[count] < el_n_deficient[_] or f[count] != 0 ) ]
-            
-            # Form bonded structure
-            for j in reactive:
-                while valid_bonds(j,tmp,elements,reactive,ring_atoms):            
-                    for k in valid_bonds(j,tmp,elements,reactive,ring_atoms): tmp[k[1],k[2]]+=k[0]
+        heavies = np.flatnonzero(( e < element_arrays(tuple(elements))[1] ) | expand_octet).tolist()
+
+        # Create a fresh copy of the initial be_mat for each q-combination of heavy atoms and add charges
+        def candidates():
+            for i in itertools.combinations_with_replacement(heavies, int(abs(qeff))):
+                tmp = bond_mat.copy()
+                for _ in i: tmp[_,_] += 1
+                yield tmp
+
+        # Different placements often saturate to the same structure, these duplicates are skipped before scoring 
+        # (find_lewis() would discard them anyway).
+        seen = set()
+        for tmp,reactive in map_saturate_bonds(candidates(),elements,ring_atoms,n_jobs):
+            b_hash = bmat_key(tmp)
+            if b_hash in seen:
+                continue
+            seen.add(b_hash)
             
             yield obj_fun(tmp),tmp, reactive
 
@@ -339,50 +455,105 @@ def gen_init(obj_fun,adj_mat,elements,rings,q):
         # Atoms with unbound electrons
         lonelies = [ count for count,_ in enumerate(bond_mat) if bond_mat[count,count] > 0 ]
 
-        # Loop over all q-combinations of atoms with unbound electrons to be oxidized
-        for i in itertools.combinations_with_replacement(lonelies, qeff):
-
-            # This construction is used to handle cases with q>1 to avoid taking more electrons than are available.
-            tmp = copy(bond_mat)
-            
-            flag = True
-            for j in i:
-                if tmp[j,j] > 0:
-                    tmp[j,j] -= 1
-                else:
-                    flag = False
-            if not flag:
+        # This construction is used to handle cases with q>1 to avoid taking more electrons than are available.
+        def candidates():
+            for i in itertools.combinations_with_replacement(lonelies, qeff):
+                tmp = bond_mat.copy()
+                flag = True
+                for j in i:
+                    if tmp[j,j] > 0:
+                        tmp[j,j] -= 1
+                    else:
+                        flag = False
+                if flag:
+                    yield tmp
+
+        # Loop over all q-combinations of atoms with unbound electrons to be oxidized (duplicate structures are skipped as above)
+        seen = set()
+        for tmp,reactive in map_saturate_bonds(candidates(),elements,ring_atoms,n_jobs):
+            b_hash = bmat_key(tmp)
+            if b_hash in seen:
                 continue
-
-            # Find reactive atoms (i.e., atoms with unbound electron(s) or deficient atoms or a formal charge)
-            e = return_e(tmp)
-            f = return_formals(tmp,elements)
-            reactive = [ count for count,_ in enumerate(elements) if ( tmp[count,count] or e[count] < el_n_deficient[_] or f[count] != 0 ) ]
-            
-            # Form bonded structure
-            for j in reactive:
-                while valid_bonds(j,tmp,elements,reactive,ring_atoms):            
-                    for k in valid_bonds(j,tmp,elements,reactive,ring_atoms): tmp[k[1],k[2]]+=k[0]
+            seen.add(b_hash)
 
             yield obj_fun(tmp),tmp,reactive
         
     else:
 
         # Find reactive atoms (i.e., atoms with unbound electron(s) or deficient atoms or a formal charge)
-        e = return_e(bond_mat)
-        f = return_formals(bond_mat,elements)
-        reactive = [ count for count,_ in enumerate(elements) if ( bond_mat[count,count] or e[count] < el_n_deficient[_] or f[count] != 0 ) and ( _ not in el_metals ) ]
+        reactive = return_reactive(bond_mat,elements,eneutral,e_def,exclude_metals=True)
         # Form bonded structure
+        n_def,expand,_ = element_scalars(tuple(elements))
         for j in reactive:
-            while valid_bonds(j,bond_mat,elements,reactive,ring_atoms):            
-                for k in valid_bonds(j,bond_mat,elements,reactive,ring_atoms): bond_mat[k[1],k[2]]+=k[0]
+            while True:
+                moves = valid_bonds(j,bond_mat,elements,reactive,ring_atoms,n_def,expand)
+                if not moves:
+                    break
+                for k in moves: bond_mat[k[1],k[2]]+=k[0]
 
         yield obj_fun(bond_mat),bond_mat,reactive
 
-def gen_all_lstructs(obj_fun, bond_mats, scores, hashes, elements, reactive, rings, ring_atoms, bridgeheads, seps, min_score, ind=0, counter=100, N_score=1000, N_max=10000, min_opt=False, min_win=False):
+def saturate_bonds(bond_mat,elements,ring_atoms):
+    """
+    Helper function for `gen_init()` that forms the bonded structure of a charged initial guess. 
+    
+    Parameters
+    ----------
+    bond_mat : array
+               The bond electron matrix of the initial guess. It is modified in place.
+
+    elements : list of lower-case elemental symbols
+               Contains elemental information indexed to the supplied adjacency matrix.
+
+    ring_atoms : set
+                 Indices of atoms in rings smaller than 10.
+
+    Returns
+    -------
+    bond_mat, reactive : tuple
+                         The saturated bond electron matrix and the list of reactive indices.
+    """
+    # Find reactive atoms (i.e., atoms with unbound electron(s) or deficient atoms or a formal charge)
+    reactive = return_reactive(bond_mat,elements)
+    
+    # Form bonded structure
+    n_def,expand,_ = element_scalars(tuple(elements))
+    for j in reactive:
+        while True:
+            moves = valid_bonds(j,bond_mat,elements,reactive,ring_atoms,n_def,expand)
+            if not moves:
+                break
+            for k in moves: bond_mat[k[1],k[2]]+=k[0]
+
+    return bond_mat,reactive
+
+def map_saturate_bonds(bond_mats,elements,ring_atoms,n_jobs=1):
+    """
+    Applies `saturate_bonds()` to each bond electron matrix in an iterable, preserving order (see `parallel_map()`).
+    """
+    return parallel_map(partial(saturate_bonds,elements=elements,ring_atoms=ring_atoms),bond_mats,n_jobs)
+
+def parallel_map(fn,items,n_jobs=1):
+    """
+    Generator that applies fn to each item of an iterable, preserving order. With n_jobs > 1 the items are dispatched to a 
+    process pool in chunks (n_jobs=-1 uses all cores), which requires fn to be picklable (e.g., a module-level function or a 
+    partial of one); otherwise they are processed lazily in serial.
+    """
+    if n_jobs == 1:
+        for item in items:
+            yield fn(item)
+        return
+
+    items = list(items)
+    n_workers = os.cpu_count() if n_jobs is None or n_jobs < 1 else n_jobs
+    chunksize = max(1,len(items)//(4*n_workers))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        yield from executor.map(fn,items,chunksize=chunksize)
+
+def gen_all_lstructs(obj_fun, bond_mats, scores, hashes, elements, reactive, rings, ring_atoms, bridgeheads, seps, min_score, ind=0, counter=100, N_score=1000, N_max=10000, min_opt=False, min_win=False, score_cache=None):
 
     """ 
-    A generator for find_lewis() that recursively applies a set of valid bond-electron moves to find all relevant resonance structures. 
+    A generator for find_lewis() that applies a set of valid bond-electron moves depth-first (using an explicit stack) to find all relevant resonance structures. 
     
     Parameters
     ----------
@@ -391,11 +562,12 @@ def gen_all_lstructs(obj_fun, bond_mats, scores, hashes, elements, reactive, rin
     
     bond_mats  : list of bond_mat arrays 
                Contains the bond-electron matrices that have already been discovered and scored. Used by the algorithm to avoid back-tracking. 
+               During the search they are held in a single (K,n,n) buffer; the returned list holds views into that buffer. 
 
     scores : list of floats
              Contains the scores for all  bond-electron matrices that have been enumerated.
     
-    hashes : set of floats
+    hashes : set of bytes
              Contains a set of bond-electron matrix  hash values used to accelerate the check for duplication. 
 
     elements : list of lower-case elemental symbols
@@ -437,6 +609,10 @@ def gen_all_lstructs(obj_fun, bond_mats, scores, hashes, elements, reactive, rin
     min_win: float, default=False
              When set, a Lewis Structure is only accepted if its score is within this value of the best structure found up to that point. This allows the algorithm to explore intermediate structures that may be less ideal but that eventually lead to an overall relaxation of the structure.  
 
+    score_cache: dict, default=None
+                 Maps bond-electron matrix hashes to their `obj_fun` score so that structures regenerated by different moves are not rescored. 
+                 Only share a cache between calls that use the same `obj_fun`.
+
     Yields
     -------
     iterator: tuple
@@ -445,99 +621,97 @@ def gen_all_lstructs(obj_fun, bond_mats, scores, hashes, elements, reactive, rin
 
     """
     
-    # Loop over all possible moves, recursively calling this function to account for the order dependence. 
+    if score_cache is None:
+        score_cache = {}
+    if not bond_mats:
+        return bond_mats,scores,hashes,min_score,counter
+
+    # The bond_mats are stored in one (capacity,n,n) buffer that is grown geometrically. Trial structures are built in the 
+    # first free slot, so a rejected move costs no allocation; accepting a structure just advances size. Rows below size are 
+    # never written again, so the move generators can hold on to views of a buffer that has since been reallocated.
+    size = len(bond_mats)
+    buf = np.empty((2*size+16,)+bond_mats[0].shape,dtype=bond_mats[0].dtype)
+    buf[:size] = bond_mats
+
+    # Loop over all possible moves, following each accepted structure depth-first to account for the order dependence. 
     # This could get very expensive very quickly, but with a well-curated moveset things are still very quick for most tested chemistries. 
-    for ind in range(0, len(bond_mats)):
-        for j in valid_moves(bond_mats[ind],elements,reactive,rings,ring_atoms,bridgeheads,seps):
-
-            # Carry out moves on trial bond_mat
-            tmp = copy(bond_mats[ind])        
-            for k in j: tmp[k[1],k[2]]+=k[0]
+    # The search is run on an explicit stack instead of recursion. Each frame mirrors one level of the former recursive call: 
+    # it loops over the bond_mats that existed when it was entered, i.e. [iterator over bond_mat indices, current index, move generator].
+    stack = [[iter(range(0, len(bond_mats))), None, None]]
+    while stack:
+        frame = stack[-1]
+
+        # Start on the next bond_mat of this frame, or return to the parent frame once they are exhausted
+        if frame[2] is None:
+            frame[1] = next(frame[0], None)
+            if frame[1] is None:
+                stack.pop()                
+                if size > N_max:
+                    break
+                continue
+            frame[2] = valid_moves(buf[frame[1]],elements,reactive,rings,ring_atoms,bridgeheads,seps)
+        ind = frame[1]
+        j = next(frame[2], None)
+        if j is None:
+            frame[2] = None
+            continue
 
-            # calc objective function and hash value
+        # Carry out moves on trial bond_mat (built in the first free slot of the buffer). Moves only touch 2-4 elements, so 
+        # scalar updates are faster here than converting the move to index arrays for np.add.at or fancy indexing
+        tmp = buf[size]
+        tmp[...] = buf[ind]
+        for k in j: tmp[k[1],k[2]]+=k[0]
+
+        # calc hash value and objective function. Every structure in hashes has a cached score, so revisiting a known
+        # structure never calls obj_fun
+        b_hash = bmat_key(tmp)    
+        score = score_cache.get(b_hash)
+        if score is None:
             score = obj_fun(tmp)
-            b_hash = bmat_hash(tmp)    
-        
-            # Check if a new best Lewis structure has been found, if so, then reset counter and record new best score
-            if score <= min_score:
-                counter = 0
-                min_score = score
-            else:
-                counter += 1
-
-            # Break if too long (> N_score) has passed without finding a better Lewis structure
-            if counter >= N_score:
-                return bond_mats,scores,hashes,min_score,counter
-
-            # If min_opt=True then the search is run in a greedy mode where only moves that reduce the score are accepted
-            if min_opt:
-
-                if counter == 0:
-                    # Check that the resulting bond_mat is not already in the existing bond_mats
-                    if b_hash not in hashes: 
-                        bond_mats += [tmp]
-                        scores += [score]
-                        hashes.add(b_hash)
-
-                        # Recursively call this function with the updated bond_mat resulting from this iteration's move. 
-                        bond_mats,scores,hashes,min_score,counter = gen_all_lstructs(obj_fun,bond_mats,scores,hashes,elements,reactive,rings,ring_atoms,bridgeheads,seps,\
-                                                                              min_score,ind=len(bond_mats)-1,counter=counter,N_score=N_score,N_max=N_max,min_opt=min_opt,min_win=min_win)
-
-            else:
-                # min_win option allows the search to follow structures that increase the score up to min_win above the score of the best structure
-                if min_win:
-                    if (score-min_score) < min_win:
-
-                        # Check that the resulting bond_mat is not already in the existing bond_mats
-                        if b_hash not in hashes: 
-                            bond_mats += [tmp]
-                            scores += [score]
-                            hashes.add(b_hash)
-                        
-                            # Recursively call this function with the updated bond_mat resulting from this iteration's move. 
-                            bond_mats,scores,hashes,min_score,counter = gen_all_lstructs(obj_fun,bond_mats,scores,hashes,elements,reactive,rings,ring_atoms,bridgeheads,seps,\
-                                                                                  min_score,ind=len(bond_mats)-1,counter=counter,N_score=N_score,N_max=N_max,min_opt=min_opt,min_win=min_win)
-
-                # otherwise all structures are recursively explored (can be very expensive)
-                else:
+            score_cache[b_hash] = score
+    
+        # Check if a new best Lewis structure has been found, if so, then reset counter and record new best score
+        if score <= min_score:
+            counter = 0
+            min_score = score
+        else:
+            counter += 1
 
-                    # Check that the resulting bond_mat is not already in the existing bond_mats
-                    if b_hash not in hashes:
-                    
-                        bond_mats += [tmp]
-                        scores += [score]
-                        hashes.add(b_hash)
+        # Break out of this frame if too long (> N_score) has passed without finding a better Lewis structure
+        if counter >= N_score:
+            stack.pop()
+            if size > N_max:
+                break
+            continue
 
-                        # Recursively call this function with the updated bond_mat resulting from this iteration's move. 
-                        bond_mats,scores,hashes,min_score,counter = gen_all_lstructs(obj_fun,bond_mats,scores,hashes,elements,reactive,rings,ring_atoms,bridgeheads,seps,\
-                                                                              min_score,ind=len(bond_mats)-1,counter=counter,N_score=N_score,N_max=N_max,min_opt=min_opt,min_win=min_win)
-                    
-            # Break if max has been encountered.
-            if len(bond_mats) > N_max:
-                return bond_mats,scores,hashes,min_score,counter
+        # If min_opt=True then the search is run in a greedy mode where only moves that reduce the score are accepted
+        if min_opt:
+            accept = counter == 0
+        # min_win option allows the search to follow structures that increase the score up to min_win above the score of the best structure
+        elif min_win:
+            accept = (score-min_score) < min_win
+        # otherwise all structures are explored (can be very expensive)
+        else:
+            accept = True
+
+        # Check that the resulting bond_mat is not already in the existing bond_mats
+        if accept and b_hash not in hashes:
+            size += 1
+            if size == len(buf):
+                buf = np.concatenate([buf,np.empty_like(buf)])
+            scores.append(score)
+            hashes.add(b_hash)
+
+            # Continue the search from the updated bond_mat resulting from this iteration's move. 
+            stack.append([iter(range(0, size)), None, None])
+            continue
+                
+        # Break if max has been encountered.
+        if size > N_max:
+            break
     
-    return bond_mats,scores,hashes,min_score,counter
+    return list(buf[:size]),scores,hashes,min_score,counter
     
-def bmat_unique(new_bond_mat,old_bond_mats):
-    """
-    Helper function for `gen_all_lstructs()` that checks whether an array already exists in a set of arrays. 
-    Deprecated because it was expensive. Now a hash is used in place of this in the comparison routine.
-    """
-    for i in old_bond_mats:
-        if all_zeros(i-new_bond_mat):
-            return False
-    return True 
-
-# Helper function for bmat_unique that checks is a numpy array is all zeroes (uses short-circuit logic to speed things up in contrast to np.any)
-def all_zeros(m):
-    """
-    Helper function for `bmat_unique()` that checks is a numpy array is all zeroes (uses short-circuit logic to speed things up in contrast to np.any) 
-    """
-    for _ in m.flat:
-        if _:
-            return False # short-circuit logic at first non-zero
-    return True
-
 def valid_moves(bond_mat,elements,reactive,rings,ring_atoms,bridgeheads,seps):
     """ 
     Generator that returns all valid moves that can be performed on a given bond-electron matrix. 
@@ -571,6 +745,8 @@ def valid_moves(bond_mat,elements,reactive,rings,ring_atoms,bridgeheads,seps):
     move: list of tuples,
 
           Each tuple in the list is composed of (int, i, j) where int is the value to be added to the ij position of the bond-electron matrix.
+          Moves are kept as small lists of python ints: building one is an order of magnitude cheaper than applying it, and the 
+          scalar updates used by the callers are faster than np.add.at on index arrays for moves of 2-6 elements.
 
     Notes
     -----            
@@ -586,103 +762,138 @@ def valid_moves(bond_mat,elements,reactive,rings,ring_atoms,bridgeheads,seps):
     (9) shuffle aromatic and anti-aromatic bonds (i.e., change bond alteration along the cycle). 
     (10) forming a pi-bond between two radicals
     All of these moves are contingent on the ability of atoms to expand octet, whether they are electron deficient, and whether the move would lead to unphysical ring-strain. 
+    The moves are yielded lazily and in a fixed order (atom by atom, then move type). `gen_all_lstructs()` is order dependent, since it 
+    follows each accepted move depth-first, so the atoms must not be processed out of order (e.g., in parallel). 
 
     """    
-    e = return_e(bond_mat) # current number of electrons associated with each atom
+    # Per-atom counts are read as python scalars, which avoids numpy scalar indexing inside the move checks
+    e = return_e(bond_mat).tolist() # current number of electrons associated with each atom
+    diag = bond_mat.diagonal() # unbound electrons on each atom
+    radical = ( diag & 1 ).astype(bool).tolist() # odd number of unbound electrons (parity by bitwise AND on the integer diagonal)
+    has_lp = ( diag >= 2 ).tolist() # at least one lone pair
+    has_ue = ( diag > 0 ).tolist() # any unbound electrons
+
+    # bond_mat is not modified while its moves are generated, so the element properties, the ring constraint, the connectivity
+    # among reactive atoms (i.e., return_connections(...,inds=reactive)), and the formal charges are all determined once up front
+    n_def,expand,ens = element_scalars(tuple(elements))
+    # (the diagonal is excluded by correcting the row counts rather than zeroing it in a copy of bond_mat)
+    multi = bond_mat > 1
+    no_multi = ( multi.sum(axis=1) == multi.diagonal() ).tolist() # atoms without double/triple bonds (may form one in a ring)
+
+    # Per-atom guards shared by the moves: ring_ok (not a ring atom OR no existing double/triple bonds, i.e., no allenes/alkynes
+    # in rings), pi_ok (ring_ok and not a bridgehead, i.e., Bredt's rule), and whether the atom can accept one (accept) or 
+    # two (accept_2) more electrons (octet can be expanded OR octet is incomplete)
+    ring_ok = [ count not in ring_atoms or _ for count,_ in enumerate(no_multi) ]
+    pi_ok = [ _ and count not in bridgeheads for count,_ in enumerate(ring_ok) ]
+    accept = [ x or n_e < n for x,n_e,n in zip(expand,e,n_def) ]
+    accept_2 = [ x or n_e+2 <= n for x,n_e,n in zip(expand,e,n_def) ]
+    r_inds = np.asarray(reactive,dtype=int)
+    sub = bond_mat[r_inds[:,None],r_inds]
+    np.fill_diagonal(sub,0)
+    conn = { i:[] for i in reactive }
+    conn_pi = { i:[] for i in reactive }
+    rows,cols = np.nonzero(sub >= 1)
+    for i,j,order in zip(r_inds[rows].tolist(),r_inds[cols].tolist(),sub[rows,cols].tolist()):
+        conn[i].append(j)
+        if order >= 2:
+            conn_pi[i].append(j)
+    # The formal charges are only read by the aromaticity checks (Moves 6 and 9), so they aren't needed without rings
+    formal_charges = return_formals(bond_mat, elements) if rings else None
+    atom_rings = {}
+    base_arom = {} # aromaticity of the rings of bond_mat, filled by delta_aromatic() as needed
+    for count,r in enumerate(rings):
+        for _ in r: atom_rings.setdefault(_,[]).append(count)
 
     # Loop over the individual atoms and determine the moves that apply
     for i in reactive:
 
         # All of these moves involve forming a double bond with the i atom. Constraints that are common to all of the moves are checked here.
         # These are avoiding forming alkynes/allenes in rings and Bredt's rule (forming double-bonds at bridgeheads)
-        if i not in bridgeheads and ( i not in ring_atoms or sum([ _ for count,_ in enumerate(bond_mat[i]) if count != i and _ > 1 ]) == 0 ):
+        if pi_ok[i]:
 
             # Move 1: i is electron deficient and has an adjacent pi-bond between neighbor and next-nearest neighbor atoms, j and k, then the j-k pi-bond is turned into a new i-j pi-bond.
-            if e[i]+2 <= el_n_deficient[elements[i]] or el_expand_octet[elements[i]]:
-                for j in return_connections(i,bond_mat,inds=reactive):
-                    for k in [ _ for _ in return_connections(j,bond_mat,inds=reactive,min_order=2) if _ != i ]:
+            if accept_2[i]:
+                for j in conn[i]:
+                    for k in [ _ for _ in conn_pi[j] if _ != i ]:
                         yield [(1,i,j),(1,j,i),(-1,j,k),(-1,k,j)]
 
             # Move 2: i has a radical and has an adjacent pi-bond between neighbor and next-nearest neighbor atoms, j and k, then the j-k pi-bond is homolytically broken and a new pi-bond is formed between i and j
-            if bond_mat[i,i] % 2 != 0 and e[i] < el_n_deficient[elements[i]]:
-                for j in return_connections(i,bond_mat,inds=reactive):
-                    for k in [ _ for _ in return_connections(j,bond_mat,inds=reactive,min_order=2) if _ != i ]:
+            if radical[i] and e[i] < n_def[i]:
+                for j in conn[i]:
+                    for k in [ _ for _ in conn_pi[j] if _ != i ]:
                         yield [(1,i,j),(1,j,i),(-1,j,k),(-1,k,j),(-1,i,i),(1,k,k)]
 
             # Move 3: i has a lone pair and has an adjacent pi-bond between neighbor and next-nearest neighbor atoms, j and k, then the j-k pi-bond is heterolytically broken to form a lone pair on k and a new pi-bond is formed between i and j
-            if bond_mat[i,i] >= 2:
-                for j in return_connections(i,bond_mat,inds=reactive):
-                    for k in [ _ for _ in return_connections(j,bond_mat,inds=reactive,min_order=2) if _ != i ]:
+            if has_lp[i]:
+                for j in conn[i]:
+                    for k in [ _ for _ in conn_pi[j] if _ != i ]:
                         yield [(1,i,j),(1,j,i),(-1,j,k),(-1,k,j),(-2,i,i),(2,k,k)]
 
-            if bond_mat[i, i]%2!=0:
-                for j in return_connections(i, bond_mat, inds=reactive):
-                    if bond_mat[j, j]%2!=0:
-                        for k in [ _ for _ in return_connections(j,bond_mat,inds=reactive,min_order=2) if _ != i ]:
+            if radical[i]:
+                for j in conn[i]:
+                    if radical[j]:
+                        for k in [ _ for _ in conn_pi[j] if _ != i ]:
                             yield [(-1, i, i), (-1, j, j), (1, i, j), (1, j, i)]
             # Move 4: i has a radical and a neighbor with unbound electrons, form a bond between i and the neighbor
-            if bond_mat[i,i] % 2 != 0 and ( el_expand_octet[elements[i]] or e[i] < el_n_deficient[elements[i]] ):
+            if radical[i] and accept[i]:
 
                 # Check on connected atoms
-                for j in return_connections(i,bond_mat,inds=reactive):
+                for j in conn[i]:
 
                     # Electron available @j
-                    if bond_mat[j,j] > 0:
+                    if has_ue[j]:
 
                         # Straightforward homogeneous bond formation if j is deficient or can expand octet
-                        if ( el_expand_octet[elements[j]] or e[j] < el_n_deficient[elements[j]] ):
+                        if accept[j]:
 
                             # Check that ring constraints don't disqualify bond-formation ( not a ring atom OR no existing double/triple bonds )
-                            if j not in ring_atoms or sum([ _ for count,_ in enumerate(bond_mat[j]) if count != j and _ > 1 ]) == 0:                  
+                            if ring_ok[j]:                  
                                 yield [(1,i,j),(1,j,i),(-1,i,i),(-1,j,j)]
 
                         # Check if CT from j can be performed to an electron deficient atom or one that can expand its octet. 
                         # This moved used to be performed as an else to the previous statement, but would miss some ylides. Now it is run in all cases to be safer.                                          
-                        if bond_mat[j,j] > 1:
+                        # The ring constraints on j don't depend on k, so they are checked before looping over the acceptors.
+                        if has_lp[j] and ring_ok[j]:
                             for k in reactive:
-                                if k != i and k != j and ( el_expand_octet[elements[k]] or e[k] < el_n_deficient[elements[k]] ):
-
-                                    # Check that ring constraints don't disqualify bond-formation ( not a ring atom OR no existing double/triple bonds )
-                                    if j not in ring_atoms or sum([ _ for count,_ in enumerate(bond_mat[j]) if count != j and _ > 1 ]) == 0:                  
-                                        yield [(1,i,j),(1,j,i),(-1,i,i),(-2,j,j),(1,k,k)]
+                                if k != i and k != j and accept[k]:
+                                    yield [(1,i,j),(1,j,i),(-1,i,i),(-2,j,j),(1,k,k)]
                                                     
             # Move 5: i has a lone pair and a neighbor capable of forming a double bond, then a new pi-bond is formed with the neighbor from the lone pair
-            if bond_mat[i,i] >= 2:
-                for j in return_connections(i,bond_mat,inds=reactive):
+            if has_lp[i]:
+                for j in conn[i]:
                     # Check ring conditions on j
-                    if j not in bridgeheads and ( j not in ring_atoms or sum([ _ for count,_ in enumerate(bond_mat[j]) if count != j and _ > 1 ]) == 0 ):
+                    if pi_ok[j]:
                         # Check octet conditions on j
-                        if el_expand_octet[elements[j]] or e[j]+2 <= el_n_deficient[elements[j]]:                    
+                        if accept_2[j]:                    
                             yield [(1,i,j),(1,j,i),(-2,i,i)]
                             
         # Move 6: i has a pi bond with j and the electronegativity of i is >= j, or a favorable change in aromaticity occurs, then the pi-bond is turned into a lone pair on i
-        for j in return_connections(i,bond_mat,inds=reactive,min_order=2):
-            formal_charges = return_formals(bond_mat, elements)
-            if el_en[elements[i]] > el_en[elements[j]] or delta_aromatic(bond_mat,rings,move=((-1,i,j),(-1,j,i),(2,i,i)),formal_charges=formal_charges) or e[j] > el_n_deficient[elements[i]]:
+        for j in conn_pi[i]:
+            # (the aromaticity check is by far the most expensive test, so it is evaluated last)
+            if ens[i] > ens[j] or e[j] > n_def[i] or delta_aromatic(bond_mat,rings,move=((-1,i,j),(-1,j,i),(2,i,i)),formal_charges=formal_charges,atom_rings=atom_rings,base_arom=base_arom):
                 yield [(-1,i,j),(-1,j,i),(2,i,i)]
 
         # Move 7: i is electron deficient, bonded to j with unbound electrons, and the electronegativity of i is >= j, then an electron is tranferred from j to i
                 # Note: very similar to move 4 except that a double bond is not formed. This is sometimes needed when j cannot expand its octet (as required by bond formation) but i still needs a full octet.
-        if e[i] < el_n_deficient[elements[i]]:
-            for j in return_connections(i,bond_mat,inds=reactive):
-                if bond_mat[j,j] > 0 and el_en[elements[i]] > el_en[elements[j]]:
+        if e[i] < n_def[i]:
+            for j in conn[i]:
+                if has_ue[j] and ens[i] > ens[j]:
                     yield [(-1,j,j),(1,i,i)]
 
         # Move 8: i has an expanded octet and unbound electrons, then charge transfer to an atom within three bonds (controlled by local option) that is electron deficient or can expand its octet is attempted.
-        if e[i] > el_n_deficient[elements[i]] and bond_mat[i,i] > 0:
+        if e[i] > n_def[i] and has_ue[i]:
             for j in reactive:
-                if j != i and seps[i,j] < 3 and ( el_expand_octet[elements[j]] or e[j] < el_n_deficient[elements[j]] ):
+                if j != i and accept[j] and seps[i,j] < 3:
                     yield [(-1,i,i),(1,j,j)]
 
         # # Move 9: i has an expanded octet and a bond with a neighbor that can be converted into a lone pair on the neighbor
-        # if e[i] > el_n_deficient[elements[i]]:
-        #     for j in return_connections(i,bond_mat,inds=reactive):
+        # if e[i] > n_def[i]:
+        #     for j in conn[i]:
         #         if bond_mat[i,j] > 0:
         #             yield [(-1,i,j),(-1,j,i),(2,j,j)]
                     
     # Move 9: shuffle aromatic and anti-aromatic bonds 
     for i in rings:
-        formal_charges = return_formals(bond_mat, elements)
         if is_aromatic(bond_mat,i,formal_charges) and len(i) % 2 == 0: 
 
             # Find starting point
@@ -713,22 +924,17 @@ def valid_moves(bond_mat,elements,reactive,rings,ring_atoms,bridgeheads,seps):
                     
                 # Loop over the atoms in the (anti)aromatic ring
                 move = []
+                ring_pos = { atom:count for count,atom in enumerate(i) }
                 for j in loop_ind:
 
                     # Get the indices of the previous and next atoms in the ring
-                    if i.index(j) == 0:
-                        prev_atom = i[len(i)-1]
-                        next_atom = i[1]
-                    elif i.index(j) == len(i)-1:
-                        prev_atom = i[i.index(j) - 1]
-                        next_atom = i[0]
-                    else:
-                        prev_atom = i[i.index(j) - 1]
-                        next_atom = i[i.index(j) + 1]
+                    pos = ring_pos[j]
+                    prev_atom = i[pos-1]
+                    next_atom = i[(pos+1)%len(i)]
 
                     # bonds are created in the forward direction.
                     if bond_mat[j,prev_atom] > 1:
-                        move += [(-1,j,prev_atom),(-1,prev_atom,j),(1,j,next_atom),(1,next_atom,j)]
+                        move.extend([(-1,j,prev_atom),(-1,prev_atom,j),(1,j,next_atom),(1,next_atom,j)])
 
                     # If there is no double-bond (between j and the next or previous) then the shuffle does not apply.
                     # Note: lone pair and electron deficient aromatic moves are handled via Moves 3 and 1 above, respectively. Pi shuffles are only handled here.
@@ -741,7 +947,7 @@ def valid_moves(bond_mat,elements,reactive,rings,ring_atoms,bridgeheads,seps):
                     #print("move9")
                     yield move
 
-def delta_aromatic(bond_mat,rings,move,formal_charges):
+def delta_aromatic(bond_mat,rings,move,formal_charges,atom_rings=None,base_arom=None):
     ''' 
     Helper function for valid moves that determines if a proposed move will results in a change in aromaticity
 
@@ -756,19 +962,54 @@ def delta_aromatic(bond_mat,rings,move,formal_charges):
     move: tuple
           (int, i, j) where int is the value to be added to the ij position of the bond-electron matrix. 
 
+    atom_rings: dict, default=None
+                Optional map from atom index to the indices of the rings containing it (e.g., built once by `valid_moves()`).
+
+    base_arom: dict, default=None
+               Optional memo of `is_aromatic()` for the rings of the unmodified bond_mat, keyed by ring index. It is filled as rings
+               are evaluated, so a caller testing several moves against the same bond_mat computes each baseline only once.
+
     Returns
     -------
     change: boolean
             True indicates that the move will result in an increase in aromaticity, False that it will not. 
+
+    Notes
+    -----
+    The move is applied to bond_mat in place and reverted before returning, which avoids copying the matrix for every candidate.
     '''
-    tmp = copy(bond_mat)
-    for k in move: tmp[k[1],k[2]]+=k[0]
-    for r in rings:
-        if ( is_aromatic(tmp,r,formal_charges) - is_aromatic(bond_mat,r,formal_charges) > 0):
+    # is_aromatic() only reads the rows of the ring atoms, so only rings containing an atom whose row is changed by the move are checked
+    touched = { k[1] for k in move }
+    if atom_rings is None:
+        inds = [ count for count,r in enumerate(rings) if not touched.isdisjoint(r) ]
+    else:
+        inds = sorted({ _ for i in touched for _ in atom_rings.get(i,()) })
+    if not inds:
+        return False
+    if base_arom is None:
+        base_arom = {}
+    if not bond_mat.flags.writeable:
+        bond_mat = bond_mat.copy()
+
+    # aromaticity values are 1,0,-1, so an anti-aromatic result can never be an increase and needs no comparison
+    saved = [ bond_mat[k[1],k[2]] for k in move ]
+    try:
+        for k in move: bond_mat[k[1],k[2]]+=k[0]
+        new = []
+        for _ in inds:
+            a = is_aromatic(bond_mat,rings[_],formal_charges)
+            if a > -1:
+                new.append((_,a))
+    finally:
+        for k,v in zip(move,saved): bond_mat[k[1],k[2]] = v
+    for _,a in new:
+        if _ not in base_arom:
+            base_arom[_] = is_aromatic(bond_mat,rings[_],formal_charges)
+        if a - base_arom[_] > 0:
             return True
     return False
     
-def valid_bonds(ind,bond_mat,elements,reactive,ring_atoms):
+def valid_bonds(ind,bond_mat,elements,reactive,ring_atoms,n_def=None,expand=None):
     '''
     This is a simple version of `valid_moves()` that only returns valid bond-formation moves with some 
     quality checks (e.g., octet violations and allenes in rings). This function is used to generate the initial guesses for the Lewis Structure.
@@ -788,6 +1029,10 @@ def valid_bonds(ind,bond_mat,elements,reactive,ring_atoms):
     ring_atoms: list
                 List of integers corresponding to the indices of bond_mat where the atoms reside in a ring. Used to avoid forming allenes and alkynes within rings.
 
+    n_def, expand: tuple, default=None
+                Optional atom-wise octet requirements and expanded octet flags (see `element_scalars()`). Callers that form many bonds
+                for the same molecule pass these once rather than having them looked up for every call.
+
     Returns
     -------
     move: list of tuples,
@@ -795,21 +1040,23 @@ def valid_bonds(ind,bond_mat,elements,reactive,ring_atoms):
           Each tuple in the list is composed of (int, i, j) where int is the value to be added to the ij position of the bond-electron matrix.
     '''
 
+    if n_def is None or expand is None:
+        n_def,expand,_ = element_scalars(tuple(elements))
     e = return_e(bond_mat) # current number of electrons associated with each atom
     
     # Check if a bond can be formed between neighbors ( electron available AND ( octet can be expanded OR octet is incomplete ))
-    if bond_mat[ind,ind] > 0 and ( el_expand_octet[elements[ind]] or e[ind] < el_n_deficient[elements[ind]] ):
+    if bond_mat[ind,ind] > 0 and ( expand[ind] or e[ind] < n_def[ind] ):
         # Check that ring constraints don't disqualify bond-formation ( not a ring atom OR no existing double/triple bonds )
         if ind not in ring_atoms or sum([ _ for count,_ in enumerate(bond_mat[ind]) if count != ind and _ > 1 ]) == 0:  
            # Check on connected atoms
            for i in return_connections(ind,bond_mat,inds=reactive):
                # Electron available AND ( octect can be expanded OR octet is incomplete )
-               if bond_mat[i,i] > 0 and ( el_expand_octet[elements[i]] or e[i] < el_n_deficient[elements[i]] ):
+               if bond_mat[i,i] > 0 and ( expand[i] or e[i] < n_def[i] ):
                    # Check that ring constraints don't disqualify bond-formation ( not a ring atom OR no existing double/triple bonds )
                    if i not in ring_atoms or sum([ _ for count,_ in enumerate(bond_mat[i]) if count != i and _ > 1 ]) == 0:                  
                        return [(1,ind,i),(1,i,ind),(-1,ind,ind),(-1,i,i)]                                       
 
-def zwitterion_penalty(bond_mat, elements):
+def zwitterion_penalty(bond_mat, elements, formal_charges=None):
     """
     Calculate penalty for zwitterionic pairs (cation-anion).
 
@@ -823,6 +1070,9 @@ def zwitterion_penalty(bond_mat, elements):
     
     elements : list 
                Contains elemental information indexed to the supplied adjacency matrix.
+
+    formal_charges : array, default=None
+                     The formal charges of bond_mat, if already calculated (e.g., by `bmat_score()`).
     
     Returns
     -------
@@ -830,31 +1080,29 @@ def zwitterion_penalty(bond_mat, elements):
               The penalty score for non-bonded zwitterionic pairs.
     """
     # Get formal charges
-    fc = return_formals(bond_mat, elements)
+    fc = return_formals(bond_mat, elements) if formal_charges is None else formal_charges
     
     # Find positive and negative charges
-    fc_pos = list(np.where(fc == 1.0)[0])
-    fc_neg = list(np.where(fc == -1.0)[0])
+    fc_pos = fc == 1.0
+    fc_neg = fc == -1.0
+    n_charged = int(np.count_nonzero(fc_pos)),int(np.count_nonzero(fc_neg))
     
-    # Track valid zwitterionic pairs (between bonded atoms)
-    valid_pos = []
-    valid_neg = []
-    
-    # Find zwitterionic pairs between bonded atoms
-    for ind in fc_pos:
-        # Get negatively charged neighbors
-        connections = [cind for cind, _ in enumerate(bond_mat[ind]) if _ > 0 and ind != cind]
-        nn = [i for i in connections if i in fc_neg]
-        if len(nn) == 1:
-            valid_pos.append(ind)
-            valid_neg.append(nn[0])
+    # Find zwitterionic pairs between bonded atoms: cations with exactly one negatively charged neighbor, and those neighbors.
+    # Only the number of charged atoms in such pairs is needed (a shared anion is counted once)
+    n_valid = 0
+    if all(n_charged):
+        bonded = bond_mat > 0
+        np.fill_diagonal(bonded, False)
+        pairs = bonded & fc_pos[:,None] & fc_neg[None,:]
+        valid_pos = pairs.sum(axis=1) == 1
+        n_valid = int(np.count_nonzero(valid_pos) + np.count_nonzero(pairs[valid_pos].any(axis=0)))
     
     # Calculate penalty for remaining charges (non-bonded zwitterionic pairs)
-    penalty = len(set(fc_pos+fc_neg)-set(valid_pos+valid_neg)) * 1.0 + len(set(valid_pos+valid_neg)) * 0.1
+    penalty = (sum(n_charged) - n_valid) * 1.0 + n_valid * 0.1
     
     return penalty
           
-def ionic_penalty(bond_mat, elements):
+def ionic_penalty(bond_mat, elements, formal_charges=None):
     """
     Calculate a general penalty for ionic species, for a single-ionic species, a penalty is applied.
     For +1 and -1 charges, a small penalty of 0.1 is applied.
@@ -867,6 +1115,9 @@ def ionic_penalty(bond_mat, elements):
     
     elements : list 
                Contains elemental information indexed to the supplied adjacency matrix.
+
+    formal_charges : array, default=None
+                     The formal charges of bond_mat, if already calculated (e.g., by `bmat_score()`).
     
     Returns
     -------
@@ -874,28 +1125,18 @@ def ionic_penalty(bond_mat, elements):
               The penalty score for non-bonded zwitterionic pairs.
     """
     # Get formal charges
-    fc = return_formals(bond_mat, elements)
-    
-    # find single charged ions
-    single_cation = list(np.where(fc == 1.0)[0])
-    single_anion = list(np.where(fc == -1.0)[0])
+    fc = return_formals(bond_mat, elements) if formal_charges is None else formal_charges
     
+    _,_,oxygens,hydrogens = element_flags(tuple(elements))
+
     # if a cation is placed on oxygen, set a penalty of 10.0
-    single_cation_penalty = 0.0
-    for i in single_cation:
-        if elements[i] == 'O':
-            single_cation_penalty += 1.0
+    single_cation_penalty = float(np.count_nonzero((fc == 1.0) & oxygens))
     
     # if an anion is placed on hydrogen, set a penalty of 10.0
-    single_anion_penalty = 0.0
-    for i in single_anion:
-        if elements[i] == 'H':
-            single_anion_penalty += 1.0
-    
-    multi_fc = list(np.where(np.abs(fc) > 1.0)[0])
+    single_anion_penalty = float(np.count_nonzero((fc == -1.0) & hydrogens))
     
     # Calculate penalty for multi-charged ions
-    multi_penalty = len(multi_fc) * 1.0
+    multi_penalty = float(np.count_nonzero(np.abs(fc) > 1.0))
     
     return multi_penalty + single_cation_penalty + single_anion_penalty
 
@@ -963,24 +1204,31 @@ def bmat_score(bond_mat,elements,rings,cat_en,an_en,rad_env,e_def,e_exp,w_def=-2
            The score for the supplied bond-electron matrix.
     """
     en = cat_en
+
+    # The atom-wise products are computed with numpy and the formal charges are calculated once and shared by all terms.
+    # The products are summed left to right in atom order (sum over tolist(), not np.dot/np.sum, which use pairwise/SIMD 
+    # summation) so that the scores are reproduced exactly. gen_all_lstructs() compares scores exactly (score <= min_score), 
+    # so even a 1 ulp change can drop one of a degenerate pair of structures (e.g., the two B=F resonance forms of HBF2).
     formal_charges = return_formals(bond_mat, elements)
+    _,deficiencies,surplus = return_e_def_exp(bond_mat,e_def,e_exp)
+    def_term = w_def*sum((deficiencies*en).tolist())
+    exp_term = w_exp*surplus.sum()
+    formal_term = w_formal*sum((formal_charges*en*np.exp(0.05*(formal_charges-1))).tolist())
+    aro_term = w_aro*sum([ is_aromatic(bond_mat,_,formal_charges)/len(_) for _ in rings ])
+    rad_term = w_rad*sum((rad_env*(bond_mat.diagonal()%2)).tolist())
+    zwitter_term = w_zwitter*zwitterion_penalty(bond_mat, elements, formal_charges)
+    ionic_term = w_ionic*ionic_penalty(bond_mat, elements, formal_charges)
     if verbose:
-        print("deficiency: {}".format(w_def*sum([ _*en[count] for count,_ in enumerate(return_def(bond_mat,elements,e_def)) ])))
-        print("expanded: {}".format(w_exp*sum(return_expanded(bond_mat,elements,e_exp))))
-        print("formals: {}".format(w_formal*sum([ _ * en[count]*np.exp(0.05*(_-1)) for count,_ in enumerate(return_formals(bond_mat,elements)) ])))
-        print("aromatic: {}".format(w_aro*sum([ is_aromatic(bond_mat,_,formal_charges)/len(_) for _ in rings ])))
-        print("radicals: {}".format(w_rad*sum([ rad_env[_]*(bond_mat[_,_]%2) for _ in range(len(bond_mat)) ])))
-        print("zwitter: {}".format(w_zwitter*zwitterion_penalty(bond_mat, elements)))
-        print("ionic: {}".format(w_ionic*ionic_penalty(bond_mat, elements)))
+        print("deficiency: {}".format(def_term))
+        print("expanded: {}".format(exp_term))
+        print("formals: {}".format(formal_term))
+        print("aromatic: {}".format(aro_term))
+        print("radicals: {}".format(rad_term))
+        print("zwitter: {}".format(zwitter_term))
+        print("ionic: {}".format(ionic_term))
 
     # objective function (lower is better): sum ( electron_deficiency * electronegativity_of_atom ) + sum ( expanded_octets ) + sum ( formal charge * electronegativity_of_atom ) + sum ( aromaticity of rings ) + factor
-    return w_def*sum([ _*en[count] for count,_ in enumerate(return_def(bond_mat,elements,e_def)) ]) + \
-          w_exp*sum(return_expanded(bond_mat,elements,e_exp)) + \
-          w_formal*sum([ _ * en[count]*np.exp(0.05*(_-1)) for count,_ in enumerate(return_formals(bond_mat,elements)) ]) + \
-          w_aro*sum([ is_aromatic(bond_mat,_,formal_charges)/len(_) for _ in rings ]) + \
-          w_zwitter*zwitterion_penalty(bond_mat, elements) + \
-          w_rad*sum([ rad_env[_]*(bond_mat[_,_]%2) for _ in range(len(bond_mat)) ]) + \
-          w_ionic*ionic_penalty(bond_mat, elements) + factor
+    return def_term + exp_term + formal_term + aro_term + zwitter_term + rad_term + ionic_term + factor
 
 def is_aromatic(bond_mat,ring,formal_charges):
     """
@@ -1071,14 +1319,15 @@ def return_e(bond_mat):
     ----------
     bond_mat : array
                A numpy array containing bond-orders in off-diagonal positions and unbound electrons along the diagonal.
-               This array is indexed to the elements list. 
+               This array is indexed to the elements list. A stack of bond-electron matrices (shape (n_mats,n,n)) is also accepted.
 
     Returns
     -------
     valencies: array
-               Contains the valence electrons possessed by each atom. This array is indexed to the bond-electron matrix.
+               Contains the valence electrons possessed by each atom. This array is indexed to the bond-electron matrix 
+               (shape (n_mats,n) for a stack).
     """
-    return np.sum(2*bond_mat,axis=1)-np.diag(bond_mat)
+    return 2*bond_mat.sum(axis=-1)-bond_mat.diagonal(axis1=-2,axis2=-1)
     
 # returns the electron deficiencies of each atom (based on octet goal)
 def return_def(bond_mat,elements,e_def):
@@ -1089,7 +1338,7 @@ def return_def(bond_mat,elements,e_def):
     ----------
     bond_mat : array
                A numpy array containing bond-orders in off-diagonal positions and unbound electrons along the diagonal.
-               This array is indexed to the elements list. 
+               This array is indexed to the elements list. A stack of bond-electron matrices (shape (n_mats,n,n)) is also accepted.
 
     elements : list 
                Contains elemental information indexed to the supplied adjacency matrix. 
@@ -1102,14 +1351,15 @@ def return_def(bond_mat,elements,e_def):
     Returns
     -------
     deficiencies: array
-                  Contains the electron deficiencies of each atom. This array is indexed to the bond-electron matrix.
+                  Contains the electron deficiencies of each atom. This array is indexed to the bond-electron matrix
+                  (shape (n_mats,n) for a stack).
 
     Notes
     -----            
     Atoms with expanded octets return 0 not a negative value.
     """        
-    tmp = np.sum(2*bond_mat,axis=1)-np.diag(bond_mat)-e_def
-    return np.where(tmp<0,tmp,0)
+    tmp = 2*bond_mat.sum(axis=-1)-bond_mat.diagonal(axis1=-2,axis2=-1)-e_def
+    return np.minimum(tmp,0,out=tmp) # clamped in place (tmp is a fresh array)
         
 def return_expanded(bond_mat,elements,e_exp):
     """
@@ -1139,8 +1389,32 @@ def return_expanded(bond_mat,elements,e_exp):
     -----            
     Atoms with electron deficiencies return 0 not a negative value.
     """                
-    tmp = np.sum(2*bond_mat,axis=1)-np.diag(bond_mat)-e_exp
-    return np.where(tmp>0,tmp,0)
+    tmp = 2*bond_mat.sum(axis=1)-bond_mat.diagonal()-e_exp
+    return np.maximum(tmp,0)
+
+def return_e_def_exp(bond_mat,e_def,e_exp):
+    """
+    Returns the results of `return_e()`, `return_def()`, and `return_expanded()` from a single reduction over the bond-electron matrix.
+
+    Parameters
+    ----------
+    bond_mat : array
+               A numpy array containing bond-orders in off-diagonal positions and unbound electrons along the diagonal.
+               This array is indexed to the elements list. 
+
+    e_def : array
+            Holds the number of electrons each atom needs to avoid a deficiency.
+
+    e_exp : array
+            Holds the number of electrons beyond which each atom has an expanded octet.
+
+    Returns
+    -------
+    valencies, deficiencies, surplus: arrays
+               The valence electrons, electron deficiencies, and excess electrons of each atom. Indexed to the bond-electron matrix.
+    """
+    e = 2*bond_mat.sum(axis=1)-bond_mat.diagonal()
+    return e,np.minimum(e-e_def,0),np.maximum(e-e_exp,0)
 
 def return_formals(bond_mat,elements): 
     """
@@ -1162,7 +1436,65 @@ def return_formals(bond_mat,elements):
              Contains the formal charge for each atom. This array is indexed to the bond-electron matrix.
 
     """
-    return  np.array([el_valence[_] for _ in elements ]) - np.sum(bond_mat,axis=1)
+    return  element_arrays(tuple(elements))[0] - bond_mat.sum(axis=1)
+
+def return_reactive(bond_mat,elements,eneutral=None,e_def=None,exclude_metals=False):
+    """
+    Returns the indices of reactive atoms, i.e., atoms with unbound electron(s), deficient atoms, or atoms with a formal charge. 
+    The valence electrons and formal charges are computed from a single row sum of the bond-electron matrix.
+
+    Parameters
+    ----------
+    bond_mat : array
+               A numpy array containing bond-orders in off-diagonal positions and unbound electrons along the diagonal.
+               This array is indexed to the elements list. 
+
+    elements : list 
+               Contains elemental information indexed to the supplied adjacency matrix. 
+               Expects a list of lower-case elemental symbols.
+
+    eneutral, e_def : arrays, default=None
+                      Atom-wise electroneutral electron counts and octet requirements. Looked up via `element_arrays()` when not supplied.
+
+    exclude_metals : bool, default=False
+                     If True, metal atoms are never reported as reactive.
+
+    Returns
+    -------
+    reactive: list
+              Contains the indices of the reactive atoms in ascending order.
+    """
+    if eneutral is None or e_def is None:
+        eneutral,e_def,_,_ = element_arrays(tuple(elements))
+    lone = bond_mat.diagonal()
+    bonds = bond_mat.sum(axis=1)
+    mask = ( lone != 0 ) | ( 2*bonds-lone < e_def ) | ( eneutral-bonds != 0 ) # unbound electrons, deficiency (return_e), formal charge (return_formals)
+    if exclude_metals:
+        mask &= ~element_flags(tuple(elements))[1]
+    return np.flatnonzero(mask).tolist()
+
+def decrement_offdiag(bond_mat,thresh):
+    """
+    Helper function for `return_n_e_accept()` and `return_n_e_donate()` that subtracts one from each off-diagonal element 
+    of the bond-electron matrix that is greater than `thresh` (i.e., removes one electron pair from those bonds).
+
+    Parameters
+    ----------
+    bond_mat : array
+               A numpy array containing bond-orders in off-diagonal positions and unbound electrons along the diagonal.
+               It is not modified.
+
+    thresh : int
+             Bond orders above this value are decremented (e.g., 0 removes the sigma bonds, 1 removes a pi bond from each multiple bond).
+
+    Returns
+    -------
+    tmp : array
+          The decremented copy of bond_mat.
+    """
+    decr = ( bond_mat > thresh ).astype(bond_mat.dtype)
+    np.fill_diagonal(decr,0)
+    return np.subtract(bond_mat,decr,out=decr) # the mask serves as the output buffer
 
 def return_n_e_accept(bond_mat,elements): 
     """
@@ -1186,12 +1518,13 @@ def return_n_e_accept(bond_mat,elements):
     na: array
         contains the number of electrons that each atom can accept.
     """
-    tmp = copy(bond_mat) # don't modify the supplied bond_mat
-    tmp[~np.eye(tmp.shape[0], dtype=bool)] -= (tmp > 1)[~np.eye(tmp.shape[0], dtype=bool)] # -1 from off-diagonal elements>1
-    tmp = tmp + np.diag([ -2 if el_expand_octet[_] else 0 for _ in elements ]) # -2 from diagonal for atoms that can expand octets.
-    e_tet = np.array([ el_n_deficient[_] for _ in elements ]) # atom-wise octet requirements for determining electron deficiencies
-    tmp = np.sum(2*tmp,axis=1)-np.diag(tmp)-e_tet # electron deficiency calculation
-    return np.where(tmp<0,-tmp,0)
+    tmp = decrement_offdiag(bond_mat,1) # -1 from off-diagonal elements>1
+    _,e_tet,_,_ = element_arrays(tuple(elements)) # atom-wise octet requirements for determining electron deficiencies
+    # electron deficiency calculation, with -2 from the diagonal for atoms that can expand octets (i.e., -4 from the bonds 
+    # term and +2 from the lone electron term) 
+    tmp = 2*tmp.sum(axis=1)-tmp.diagonal()-2*element_flags(tuple(elements))[0]-e_tet
+    np.negative(tmp,out=tmp)
+    return np.maximum(tmp,0,out=tmp) # clamped in place (tmp is a fresh array)
 
 def return_n_e_donate(bond_mat,elements): 
     """
@@ -1214,9 +1547,8 @@ def return_n_e_donate(bond_mat,elements):
     na: array
         contains the number of electrons that each atom can accept.
     """
-    tmp = copy(bond_mat) # don't modify the supplied bond_mat
-    tmp[~np.eye(tmp.shape[0], dtype=bool)] -= (tmp > 0)[~np.eye(tmp.shape[0], dtype=bool)] # -1 from off-diagonal elements>0
-    return np.sum(2*tmp,axis=1)-np.diag(tmp) # number of electrons associated with the atom after removing sigma-bonds.
+    tmp = decrement_offdiag(bond_mat,0) # -1 from off-diagonal elements>0
+    return 2*tmp.sum(axis=1)-tmp.diagonal() # number of electrons associated with the atom after removing sigma-bonds.
     
 def return_connections(ind,bond_mat,inds=None,min_order=1):
     """
@@ -1244,10 +1576,16 @@ def return_connections(ind,bond_mat,inds=None,min_order=1):
     connections: list
                  Contains the indices of the bonded atoms subject to the `inds` and `min_order` arguments.
     """        
+    # With inds, the row is read once as python scalars, which avoids numpy scalar indexing for every candidate. The full row 
+    # is scanned with one vectorized comparison instead
     if inds:
-        return [ _ for _ in inds if bond_mat[ind,_] >= min_order and _ != ind ]
+        row = bond_mat[ind].tolist()
+        return [ _ for _ in inds if row[_] >= min_order and _ != ind ]
     else:
-        return [ count for count,_ in enumerate(bond_mat[ind]) if _ >= min_order and count != ind ]        
+        connections = np.flatnonzero(bond_mat[ind] >= min_order).tolist()
+        if ind in connections:
+            connections.remove(ind)
+        return connections        
 
 def return_bo_dict(y,score_thresh=0.0):
     """
@@ -1272,13 +1610,18 @@ def return_bo_dict(y,score_thresh=0.0):
               the bond between atoms 4 and 6 you can use bo_dict[4][6] or bo_dict[6][4]. By default, unbonded atoms
               have `None` as their bond-order. 
     """
-    inds = [ count for count,_ in enumerate(y.bond_mat_scores) if _ <= score_thresh ]
-    if len(inds) == 0: inds = [0] # handle the case where no matrices satisfy the threshold. 
-    bonds = [ (count_i,count_j) for count_i,i in enumerate(y.bond_mats[0]) for count_j,j in enumerate(i) if ( count_j > count_i and j > 0 ) ]
-    bo_dict = { i:{ j:None for j in range(len(y.bond_mats[0])) } for i in range(len(y.bond_mats[0])) }
-    for i in bonds:
-        bo_dict[i[0]][i[1]] = set([ int(y.bond_mats[_][i[0],i[1]]) for _ in inds ])
-        bo_dict[i[1]][i[0]] = bo_dict[i[0]][i[1]]
+    inds = np.flatnonzero(np.asarray(y.bond_mat_scores) <= score_thresh)
+    if inds.size == 0: inds = [0] # handle the case where no matrices satisfy the threshold. 
+    # The bonds (upper triangle of the first bond_mat) and their orders across the selected bond_mats are gathered with one
+    # fancy index into the stack, i.e., edges[k] holds the bond orders of bond (iu[k],ju[k]) in each selected bond_mat
+    bond_mats = np.asarray(y.bond_mats) # (no copy if the bond_mats are already stacked)
+    n = len(bond_mats[0])
+    iu,ju = np.nonzero(np.triu(bond_mats[0],k=1) > 0)
+    edges = bond_mats[inds][:,iu,ju].T.astype(int).tolist()
+    bo_dict = { i:dict.fromkeys(range(n)) for i in range(n) }
+    for i,j,orders in zip(iu.tolist(),ju.tolist(),edges):
+        bo_dict[i][j] = set(orders)
+        bo_dict[j][i] = bo_dict[i][j]
         
     return bo_dict
 
@@ -1307,49 +1650,72 @@ def adjust_metals(bond_mats,adj_mat,elements):
     -------
     bond_mats: list of arrays
                Contains the bond-electron matrices that have been updated to account for the nature of the ligands
-               about the metal center. 
+               about the metal center. When metals are present these are returned as one C-contiguous int8 array.
     """
 
+    # Most molecules have no metals, so this is checked before any other work
+    m_inds = np.flatnonzero(element_flags(tuple(elements))[1]).tolist()
+    if not m_inds:
+        return bond_mats
+
     # list of electron counts for determining electron deficiencies
-    e_def = np.array([ el_n_deficient[_] for _ in elements ])
-    m_inds = [ count for count,_ in enumerate(elements) if _ in el_metals ]
-    for b in bond_mats:
-        defs = return_def(b,elements,e_def)                                
+    _,e_def,_,_ = element_arrays(tuple(elements))
+
+    # The updates below are scalar writes into each bond_mat, so they are made on one C-contiguous int8 (n_mats,n,n) array. This 
+    # is a no-op for the stacked bond_mats from find_lewis()
+    bond_mats = np.ascontiguousarray(bond_mats,dtype=np.int8)
+
+    # The ligands (non-metal connections) and metal-metal connections only depend on adj_mat, so they are shared by all bond_mats.
+    # They are read from a CSR-style neighbor list (indptr, indices) of the metal rows, which is built with one nonzero() call
+    # rather than a python scan over each row (i.e., return_connections(m_ind,adj_mat))
+    m_set = set(m_inds)
+    rows,indices = np.nonzero(adj_mat[m_inds] >= 1)
+    indptr = np.searchsorted(rows,np.arange(len(m_inds)+1)).tolist()
+    indices = indices.tolist()
+    ligands = {}
+    m_cons = {}
+    for count,m_ind in enumerate(m_inds):
+        cons = [ _ for _ in indices[indptr[count]:indptr[count+1]] if _ != m_ind ]
+        ligands[m_ind] = [ _ for _ in cons if _ not in m_set ]
+        m_cons[m_ind] = [ _ for _ in cons if _ in m_set ]
+    # The bond_mats are independent, so the ligands are handled for all of them first (with the deficiencies of the whole 
+    # stack computed in one batched pass) and the metal-metal bonds are formed afterwards. Each bond_mat only takes a few 
+    # microseconds, so these loops are run serially rather than through `parallel_map()`, whose pool startup would dominate
+    for b,defs in zip(bond_mats,return_def(bond_mats,elements,e_def).tolist()):
         for m_ind in m_inds:
-            for con in return_connections(m_ind,adj_mat):            
+            # type M - metal metal are handled at the end (not included in ligands)
+            for con in ligands[m_ind]:
 
-                # type M - metal metal are handled at the end
-                if con in m_inds:
-                    continue                
                 # type L - dative bonds
-                elif defs[con] == 0:
+                if defs[con] == 0:
                     continue                    
-                # type X - covalent bonds
-                elif b[con,con] % 2 != 0:                    
-                    b[con,con] += -1
-                    b[m_ind,m_ind] += -1
-                    b[con,m_ind] += 1
-                    b[m_ind,con] += 1
-                # type Z - covalent bond, empty p orbital, using two electrons from the metal
-                else:
-                    b[m_ind,m_ind] += -2
-                    b[con,m_ind] += 1
-                    b[m_ind,con] += 1
-
-        # handle metal-metal bonds
-        electrons = return_e(b)
-        for m_ind in m_inds:
-            for con in return_connections(m_ind,adj_mat,inds=m_inds):
-                count = 0
-                while electrons[m_ind] < 12 and electrons[con] < 12 and b[con,con] > 0:
-                    b[m_ind,m_ind] += -1
-                    b[con,con] += -1
-                    b[m_ind,con] += 1
-                    b[con,m_ind] += 1
-                    electrons = return_e(b)                    
-                    count += 1
-                    if count == 4:
-                        break
+                # type X - covalent bonds, using the radical electron of the ligand and one electron from the metal (odd parity)
+                # type Z - covalent bond, empty p orbital, using two electrons from the metal (even parity)
+                # (the symmetric pair is written with two scalar stores, which is faster than a paired-index scatter or np.add.at here)
+                parity = b[con,con] & 1
+                b[con,con] -= parity
+                b[m_ind,m_ind] -= 2 - parity
+                b[con,m_ind] += 1
+                b[m_ind,con] += 1
+
+    # handle metal-metal bonds. Each bond formed moves one unbound electron from each metal into the bond. With 
+    # return_e() = 2*(row sum) - diagonal, the row sums of both metals are unchanged and their diagonals drop by one, 
+    # so each count goes up by one (the other atoms are unchanged) and the counts are updated in place
+    if any(m_cons.values()): # (a single metal, or metals that aren't bonded together, form no metal-metal bonds)
+        for b,electrons in zip(bond_mats,return_e(bond_mats).tolist()):
+            for m_ind in m_inds:
+                for con in m_cons[m_ind]:
+                    count = 0
+                    while electrons[m_ind] < 12 and electrons[con] < 12 and b[con,con] > 0:
+                        b[m_ind,m_ind] += -1
+                        b[con,con] += -1
+                        b[m_ind,con] += 1
+                        b[con,m_ind] += 1
+                        electrons[m_ind] += 1
+                        electrons[con] += 1
+                        count += 1
+                        if count == 4:
+                            break
     return bond_mats
 
 
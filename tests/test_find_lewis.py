@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from ReactBench.utils.find_lewis import LewisStructureError, find_lewis
+
+
+def adjacency(n, bonds):
+    adj_mat = np.zeros((n, n))
+    for i, j in bonds:
+        adj_mat[i, j] = adj_mat[j, i] = 1
+    return adj_mat
+
+
+def test_degenerate_resonance_structures_are_kept():
+    # HBF2: the B=F double bond can sit on either fluorine. The two structures are mirror images, so they must score
+    # identically and both must be returned.
+    elements = ['F', 'B', 'F', 'H']
+    bond_mats, scores = find_lewis(elements, adjacency(4, [(0, 1), (1, 2), (1, 3)]), q=0)
+    assert len(bond_mats) == 2
+    assert scores[0] == scores[1]
+    assert sorted([ int(_[0, 1]) for _ in bond_mats ]) == [1, 2]
+
+
+def test_int8_overflow_is_rejected():
+    # The bond-electron matrices are int8; a charge that would push an atom past 127 electrons must raise, not wrap.
+    with pytest.raises(LewisStructureError):
+        find_lewis(['F', 'B', 'F', 'H'], adjacency(4, [(0, 1), (1, 2), (1, 3)]), q=-130)